@@ -387,6 +387,10 @@ extern double	heat_stor(double cp, double spm, double tdif);
 extern int      hle1(double press, double ta, double ts, double za,
 		     double ea, double es, double zq, double u, double zu,
 		     double z0, double *h, double *le, double *e);
+extern int      hle1_warm(double press, double ta, double ts, double za,
+		     double ea, double es, double zq, double u, double zu,
+		     double z0, double *lo, int *iters, double *h, double *le,
+		     double *e);
 extern double   psychrom(double tdry, double twet, double press);
 extern double   wetbulb(double ta, double dpt, double press);
 extern double   ri_no(double z2, double z1, double t2, double t1,
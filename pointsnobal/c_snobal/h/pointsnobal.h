@@ -58,6 +58,7 @@ typedef struct {
 	double E_s_sum;
 	double melt_sum;
 	double ro_pred_sum;
+	double obukhov_lo;
 } OUTPUT_REC;
 //typedef OUTPUT_REC *out_p;
 //extern OUTPUT_REC output_rec[100];	/* output data structure */
@@ -98,6 +99,7 @@ typedef struct {
 	double* E_s_sum;
 	double* melt_sum;
 	double* ro_pred_sum;
+	double* obukhov_lo;
 } OUTPUT_REC_ARR;
 
 typedef struct {
@@ -121,8 +123,93 @@ typedef struct {
 	int relative_heights;
 	double max_h2o_vol;
 	double max_z_s_0;
+	int warm_start;
 } PARAMS;
 
+/*
+ * Energy balance inputs and outputs for a set of pixels, as
+ * struct of arrays for e_bal_block and e_bal_scalar
+ */
+typedef struct {
+	/* snowcover and climate inputs */
+	int* layer_count;
+	int* precip_now;
+	double* S_n;
+	double* I_lw;
+	double* T_a;
+	double* e_a;		/* clamped to saturation on return */
+	double* u;
+	double* T_g;
+	double* P_a;
+	double* z_0;
+	double* z_s;
+	double* z_s_0;
+	double* z_s_l;
+	double* rho;
+	double* T_s_0;
+	double* T_s_l;
+	double* m_rain;
+	double* m_snow;
+	double* T_rain;
+	double* T_snow;
+	/* energy balance outputs */
+	double* R_n;
+	double* H;
+	double* L_v_E;
+	double* E;
+	double* G;
+	double* G_0;
+	double* M;
+	double* delta_Q;
+	double* delta_Q_0;
+	int* status;		/* TRUE if the pixel's energy balance was computed */
+} EBAL_REC_ARR;
+
+/*
+ * Quantities that can be aggregated over the data timesteps of
+ * call_snobal_grid. State variables take their value at the end of each
+ * data timestep, fluxes their mean over it and mass totals their sum.
+ * The snow temperatures, density and saturation are only aggregated over
+ * the timesteps with snow (T_s_l with two layers), NaN if there are none.
+ */
+#define AGG_T_s_0	0
+#define AGG_T_s_l	1
+#define AGG_T_s		2
+#define AGG_z_s		3
+#define AGG_rho		4
+#define AGG_m_s		5
+#define AGG_h2o		6
+#define AGG_h2o_sat	7
+#define AGG_cc_s	8
+#define AGG_R_n		9	/* fluxes (W/m^2) */
+#define AGG_H		10
+#define AGG_L_v_E	11
+#define AGG_G		12
+#define AGG_M		13
+#define AGG_delta_Q	14
+#define AGG_G_0		15
+#define AGG_delta_Q_0	16
+#define AGG_E_s		17	/* mass totals (kg/m^2) */
+#define AGG_melt	18
+#define AGG_ro_predict	19
+#define AGG_NVARS	20
+
+#define AGG_FIRST_FLUX	AGG_R_n
+#define AGG_FIRST_MASS	AGG_E_s
+
+/* aggregation statistics */
+#define AGG_MEAN	0
+#define AGG_MIN		1
+#define AGG_MAX		2
+#define AGG_SUM		3
+
+typedef struct {
+	int var;		/* AGG_* quantity */
+	int stat;		/* AGG_MEAN, AGG_MIN, AGG_MAX or AGG_SUM */
+	int period;		/* # of data timesteps in each aggregate */
+	double* out;		/* period k of pixel n at k * N + n */
+} AGGREGATOR;
+
 /* ------------------------------------------------------------------------- */
 
 /*
@@ -131,6 +218,10 @@ typedef struct {
 
 //extern int call_snobal(int N, int nthreads, int first_step, TSTEP_REC tstep_info[4], OUTPUT_REC** output_rec, INPUT_REC_ARR* input1, INPUT_REC_ARR* input2, PARAMS params, OUTPUT_REC_ARR* output1);
 extern int call_snobal(int N, int nthreads, int first_step, TSTEP_REC tstep_info[4], INPUT_REC_ARR* input1, INPUT_REC_ARR* input2, PARAMS params, OUTPUT_REC_ARR* output1);
+extern int e_bal_block(int N, double time_step, PARAMS params, EBAL_REC_ARR* eb);
+extern int e_bal_scalar(int N, double time_step, PARAMS params, EBAL_REC_ARR* eb);
+extern void hle1_counters(long *calls, long *iters, int reset);
+extern int call_snobal_grid(int N, int T, int nthreads, int schedule, int chunk, int first_touch, TSTEP_REC tstep_info[4], INPUT_REC_ARR* inputs, PARAMS params, OUTPUT_REC_ARR* state, int* out_steps, OUTPUT_REC_ARR* outputs, int n_aggs, AGGREGATOR* aggs);
 
 //extern	void	assign_buffers (int masked, int n, int output, OUTPUT_REC **output_rec);
 //extern	void	buffers        (void);
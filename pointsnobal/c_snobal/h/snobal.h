@@ -248,6 +248,14 @@ extern  double  M;              /* advected heat from precip (W/m^2) */
 extern  double  delta_Q;        /* change in snowcover's energy (W/m^2) */
 extern  double  delta_Q_0;      /* change in active layer's energy (W/m^2) */
 
+/*   turbulent transfer iteration (hle1)   */
+
+extern	int	warm_start;	/* start hle1 from the last Obukhov length? */
+extern	double	obukhov_lo;	/* last converged Obukhov length (m),
+				   HUGE_VAL if neutral or unknown */
+extern	long	hle1_calls;	/* # of hle1 calls in this thread */
+extern	long	hle1_iters;	/* # of hle1 iterations in this thread */
+
 /*   averages of energy balance vars since last output record   */
 
 extern	double	R_n_bar;
@@ -281,6 +289,6 @@ extern	double	ro_pred_sum;
 		P_a, relative_hts, z_g, z_u, z_T, z_0, precip_now, m_pp, percent_snow, rho_snow, T_pp, T_rain, T_snow, \
 		h2o_sat_snow, m_precip, m_rain, m_snow, z_snow, R_n, H, L_v_E, G, G_0, M, delta_Q, delta_Q_0, R_n_bar, \
 		H_bar, L_v_E_bar, G_bar, G_0_bar, M_bar, delta_Q_bar, delta_Q_0_bar, melt, E, E_s, ro_predict, \
-		melt_sum, E_s_sum, ro_pred_sum, out_func)
+		melt_sum, E_s_sum, ro_pred_sum, out_func, warm_start, obukhov_lo, hle1_calls, hle1_iters)
 
 #endif /* _SNOBAL_H_ */
@@ -28,15 +28,11 @@
 //#include        "ipw.h"
 #include        "_snobal.h"
 #include	"envphys.h"
+#include	"_e_bal.h"
 
 void
 _advec(void)
 {
-	if (precip_now) {
-		M = (heat_stor(CP_WATER(T_rain), m_rain, (T_rain - T_s_0)) +
-		     heat_stor(CP_ICE(T_snow), m_snow, (T_snow - T_s_0)))
- 		    / time_step;
-	}
-	else
-		M = 0.0;
+	M = eb_advec(precip_now, m_rain, T_rain, m_snow, T_snow, T_s_0,
+			time_step);
 }
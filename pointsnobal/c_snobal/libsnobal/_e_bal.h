@@ -0,0 +1,456 @@
+/*
+** NAME
+**      _e_bal.h
+**
+** DESCRIPTION
+**      Private include file with the inline pieces of the energy
+**	balance: saturation vapor pressure, the hle1 psi-functions and
+**	Obukhov length iteration, efcon, ssxfr, g_soil, g_snow, net
+**	radiation and advection.
+**
+**	They are shared by the scalar library functions (satw, sati,
+**	efcon, ssxfr, heat_stor, g_soil, g_snow, hle1, _net_rad, _advec)
+**	and the batched e_bal_block kernel, so both evaluate the same
+**	physics. They have no error checks or messages; the callers check
+**	their inputs.
+*/
+
+#ifndef _PRIV_E_BAL_H_
+#define _PRIV_E_BAL_H_
+
+#include <math.h>
+
+#include "envphys.h"
+#include "radiation.h"
+#include "snow.h"
+
+/* hle1 constants */
+#define AH		1.0	/* ratio sensible/momentum phi func	*/
+#define AV		1.0	/* ratio latent/momentum phi func	*/
+#define ITMAX		50	/* max # iterations allowed		*/
+#define PAESCHKE	7.35	/* Paeschke's const (eq. 5.3)		*/
+#define THRESH		1.e-5	/* convergence threshold		*/
+#define BETA_S		5.2
+#define BETA_U		16
+
+/* eb_hle1_check return codes */
+#define HLE1_OK		0
+#define HLE1_BAD_HEIGHT	1	/* heights not above z0		*/
+#define HLE1_BAD_TEMP	2	/* temperatures not Kelvin		*/
+#define HLE1_BAD_PRESS	3	/* pressures not positive		*/
+#define HLE1_BAD_VP	4	/* vapor pressure way above saturation	*/
+
+/* ----------------------------------------------------------------------- */
+
+/*
+ * saturation vapor pressure (Pa) over water, tk > 0 (K)
+ */
+static inline double
+eb_satw(
+		double  tk)
+{
+	double  l10 = log(1.e1);
+	double  x;
+
+	x = -7.90298*(BOIL/tk-1.) + 5.02808*log(BOIL/tk)/l10 -
+			1.3816e-7*(pow(1.e1,1.1344e1*(1.-tk/BOIL))-1.) +
+			8.1328e-3*(pow(1.e1,-3.49149*(BOIL/tk-1.))-1.) +
+			log(SEA_LEVEL)/l10;
+
+	return pow(1.e1,x);
+}
+
+/*
+ * saturation vapor pressure (Pa) over ice, over water above freezing,
+ * tk > 0 (K)
+ */
+static inline double
+eb_sati(
+		double  tk)
+{
+	double  l10;
+	double  x;
+
+	if (tk > FREEZE)
+		return eb_satw(tk);
+
+	l10 = log(1.e1);
+
+	x = pow(1.e1,-9.09718*((FREEZE/tk)-1.) - 3.56654*log(FREEZE/tk)/l10 +
+			8.76793e-1*(1.-(tk/FREEZE)) + log(6.1071)/l10);
+
+	return(x*1.e2);
+}
+
+/* ----------------------------------------------------------------------- */
+
+/*
+ * psi-functions for momentum and for sensible and latent heat flux
+ */
+static inline double
+eb_psi_m(
+		double	zeta)		/* z/lo				*/
+{
+	double	x;		/* height function variable	*/
+
+	if (zeta > 0) {		/* stable */
+		if (zeta > 1)
+			zeta = 1;
+		return -BETA_S * zeta;
+	}
+	if (zeta < 0) {		/* unstable */
+		x = sqrt(sqrt(1 - BETA_U * zeta));
+		return 2 * log((1+x)/2) + log((1+x*x)/2) -
+			2 * atan(x) + M_PI_2;
+	}
+	return 0;		/* neutral */
+}
+
+static inline double
+eb_psi_h(
+		double	zeta)		/* z/lo				*/
+{
+	double	x;		/* height function variable	*/
+
+	if (zeta > 0) {		/* stable */
+		if (zeta > 1)
+			zeta = 1;
+		return -BETA_S * zeta;
+	}
+	if (zeta < 0) {		/* unstable */
+		x = sqrt(sqrt(1 - BETA_U * zeta));
+		return 2 * log((1+x*x)/2);
+	}
+	return 0;		/* neutral */
+}
+
+/* ----------------------------------------------------------------------- */
+
+/*
+ * hle1 input checks, returns HLE1_OK or the first check that failed
+ */
+static inline int
+eb_hle1_check(
+		double	press,	/* air pressure (Pa)			*/
+		double	ta,	/* air temperature (K) at height za	*/
+		double	ts,	/* surface temperature (K)		*/
+		double	za,	/* height of air temp measurement (m)	*/
+		double	ea,	/* vapor pressure (Pa) at height zq	*/
+		double	es,	/* vapor pressure (Pa) at surface	*/
+		double	zq,	/* height of spec hum measurement (m)	*/
+		double	zu,	/* height of wind speed measurement (m)	*/
+		double	z0)	/* roughness length (m)			*/
+{
+	/* heights must be positive */
+	if (z0 <= 0 || zq <= z0 || zu <= z0 || za <= z0)
+		return HLE1_BAD_HEIGHT;
+
+	/* temperatures are Kelvin */
+	if (ta <= 0 || ts <= 0)
+		return HLE1_BAD_TEMP;
+
+	/* pressures must be positive */
+	if (ea <= 0 || es <= 0 || press <= 0 || ea >= press || es >= press)
+		return HLE1_BAD_PRESS;
+
+	/* vapor pressures can't exceed saturation, if way off stop */
+	if ((es - 25.0) > eb_sati(ts) || (ea - 25.0) > eb_satw(ta))
+		return HLE1_BAD_VP;
+
+	return HLE1_OK;
+}
+
+/*
+ * Terms of the hle1 iteration that do not change with the Obukhov
+ * length, for inputs that passed eb_hle1_check
+ */
+static inline void
+eb_hle1_setup(
+		double	press,	/* air pressure (Pa)			*/
+		double	ta,	/* air temperature (K) at height za	*/
+		double	ts,	/* surface temperature (K)		*/
+		double	za,	/* height of air temp measurement (m)	*/
+		double	ea,	/* vapor pressure (Pa) at height zq	*/
+		double	es,	/* vapor pressure (Pa) at surface	*/
+		double	zq,	/* height of spec hum measurement (m)	*/
+		double	zu,	/* height of wind speed measurement (m)	*/
+		double	z0,	/* roughness length (m)			*/
+
+		/* output variables */
+
+		double *ltsm,	/* log ((zu-d0)/z0)			*/
+		double *ltsh,	/* log ((za-d0)/z0)			*/
+		double *ltsv,	/* log ((zq-d0)/z0)			*/
+		double *qa,	/* specific humidity at height zq	*/
+		double *qs,	/* specific humidity at surface		*/
+		double *pta,	/* potential air temperature (K)	*/
+		double *dens)	/* air density				*/
+{
+	double	d0;	/* displacement height (eq. 5.3)	*/
+
+	/* fix up vapor pressures above saturation */
+	if (es > eb_sati(ts))
+		es = eb_sati(ts);
+	if (ea > eb_satw(ta))
+		ea = eb_satw(ta);
+
+	/*
+	 * displacement plane height, eq. 5.3 & 5.4
+	 */
+	d0 = 2 * PAESCHKE * z0 / 3;
+
+	/*
+	 * constant log expressions
+	 */
+	*ltsm = log((zu - d0) / z0);
+	*ltsh = log((za - d0) / z0);
+	*ltsv = log((zq - d0) / z0);
+
+	/*
+	 * convert vapor pressures to specific humidities
+	 */
+	*qa = SPEC_HUM(ea, press);
+	*qs = SPEC_HUM(es, press);
+
+	/*
+	 * convert temperature to potential temperature
+	 */
+	*pta = ta + DALR * za;
+
+	/*
+	 * air density at press, virtual temp of geometric mean
+	 * of air and surface
+	 */
+	*dens = GAS_DEN(press, MOL_AIR,
+			VIR_TEMP(sqrt(*pta*ts), sqrt(ea*es), press));
+}
+
+/*
+ * Friction velocity and fluxes for an Obukhov length, HUGE_VAL for
+ * neutral stability
+ */
+static inline void
+eb_hle1_fluxes(
+		double	lo,	/* Obukhov stability length (eq. 4.25)	*/
+		double	u,	/* wind speed (m/s) at height zu	*/
+		double	zu,	/* height of wind speed measurement (m)	*/
+		double	za,	/* height of air temp measurement (m)	*/
+		double	zq,	/* height of spec hum measurement (m)	*/
+		double	ltsm,
+		double	ltsh,
+		double	ltsv,
+		double	qa,
+		double	qs,
+		double	pta,	/* potential air temperature (K)	*/
+		double	ts,	/* surface temperature (K)		*/
+		double	dens,
+
+		/* output variables */
+
+		double *ustar,	/* friction velocity (eq. 4.34')	*/
+		double *h,	/* sens heat flux (+ to surf) (W/m^2)	*/
+		double *e)	/* mass flux (+ to surf) (kg/m^2/s)	*/
+{
+	double	factor;
+
+	/*
+	 * friction velocity, eq. 4.34'
+	 */
+	*ustar = VON_KARMAN * u / (ltsm - eb_psi_m(zu/lo));
+
+	/*
+	 * evaporative flux, eq. 4.33'
+	 */
+	factor = VON_KARMAN * *ustar * dens;
+	*e = (qa - qs) * factor * AV / (ltsv - eb_psi_h(zq/lo));
+
+	/*
+	 * sensible heat flus, eq. 4.35'
+	 * with sign reversed
+	 */
+	*h = (pta - ts) * factor * AH * CP_AIR / (ltsh - eb_psi_h(za/lo));
+}
+
+/*
+ * Obukhov stability length from the fluxes, eq 4.25, but no minus sign
+ * as we define positive H as toward surface
+ */
+static inline double
+eb_hle1_lo(
+		double	ustar,
+		double	dens,
+		double	h,
+		double	e,
+		double	pta)
+{
+	return ustar * ustar * ustar * dens /
+		(VON_KARMAN * GRAVITY * (h/(pta*CP_AIR) + 0.61 * e));
+}
+
+/*
+ * Has the Obukhov length iteration converged?
+ */
+static inline int
+eb_hle1_converged(
+		double	last,	/* last guess at lo			*/
+		double	lo)
+{
+	double	diff = last - lo;
+
+	return ! (fabs(diff) > THRESH && fabs(diff/lo) > THRESH);
+}
+
+/*
+ * latent heat of vaporization, plus fusion at or below freezing
+ */
+static inline double
+eb_xlh(
+		double	ts)	/* surface temperature (K)		*/
+{
+	double	xlh = LH_VAP(ts);
+
+	if (ts <= FREEZE)
+		xlh += LH_FUS(ts);
+	return xlh;
+}
+
+/* ----------------------------------------------------------------------- */
+
+/*
+ * efcon with the saturation vapor pressure at the layer temperature
+ */
+static inline double
+eb_efcon(
+	double	k,	/* layer thermal conductivity (J/(m K sec)) */
+	double	t,	/* layer temperature (K)		    */
+	double	p,	/* air pressure (Pa)  			    */
+	double	e)	/* saturation vapor pressure at t (Pa)	    */
+{
+	double	lh;
+
+	/*	set latent heat from layer temp.	*/
+	if(t > FREEZE)
+		lh = LH_VAP(t);
+	else if(t == FREEZE)
+		lh = (LH_VAP(t) + LH_SUB(t)) / 2.0;
+	else
+		lh = LH_SUB(t);
+
+	/*	effective layer conductivity with the effective layer
+		diffusion (see Anderson, 1976, pg. 32)	*/
+	return k + (lh * DIFFUS(p, t) * MIX_RATIO(e, p));
+}
+
+static inline double
+eb_ssxfr(
+	double	k1,	/* layer 1's thermal conductivity (J / (m K sec))  */
+	double	k2,	/* layer 2's    "         "                        */
+	double	t1,	/* layer 1's average layer temperature (K)	   */
+	double	t2,	/* layer 2's    "      "        "         	   */
+	double	d1,     /* layer 1's thickness (m)			   */
+	double	d2)     /* layer 2's    "       "			   */
+{
+	return 2.0 * (k1 * k2 * (t2 - t1)) / ((k2 * d1) + (k1 * d2));
+}
+
+/*
+ * g_soil for tsno at or below freezing, with the saturation vapor
+ * pressures at tg and tsno
+ */
+static inline double
+eb_g_soil(
+		double	rho,	/* snow layer's density (kg/m^3)	     */
+		double	tsno,	/* snow layer's temperature (K)		     */
+		double	tg,	/* soil temperature (K)			     */
+		double	ds,	/* snow layer's thickness (m)		     */
+		double	dg,	/* dpeth of soil temperature measurement (m) */
+		double	pa,	/* air pressure (Pa)			     */
+		double	e_g,	/* saturation vapor pressure at tg (Pa)	     */
+		double	e_sno)	/* saturation vapor pressure at tsno (Pa)    */
+{
+	double	k_g;
+	double	k_s;
+
+	/*	set effective soil conductivity	*/
+	/***	changed to KT_MOISTSAND by D. Marks, NWRC, 09/30/2003	***/
+	/***	based on heat flux data from RMSP			***/
+	/***	note: Kt should be passed as an argument		***/
+	/***	k_g = efcon(KT_WETSAND, tg, pa);			***/
+	k_g = eb_efcon(KT_MOISTSAND, tg, pa, e_g);
+
+	/*	set snow conductivity	*/
+	k_s = eb_efcon(KTS(rho), tsno, pa, e_sno);
+
+	return eb_ssxfr(k_s, k_g, tsno, tg, ds, dg);
+}
+
+/*
+ * g_snow for ts1 != ts2, with the saturation vapor pressures at ts1 and
+ * ts2
+ */
+static inline double
+eb_g_snow(
+	double	rho1,	/* upper snow layer's density (kg/m^3)	*/
+	double	rho2,	/* lower  "     "        "    (kg/m^3)	*/
+	double	ts1,	/* upper snow layer's temperature (K)	*/
+	double	ts2,	/* lower  "     "         "       (K)	*/
+	double	ds1,	/* upper snow layer's thickness (m)	*/
+	double	ds2,	/* lower  "     "         "     (m)	*/
+	double	pa,	/* air pressure (Pa)			*/
+	double	e1,	/* saturation vapor pressure at ts1 (Pa) */
+	double	e2)	/* saturation vapor pressure at ts2 (Pa) */
+{
+	double	k_s1;
+	double	k_s2;
+
+	k_s1 = eb_efcon(KTS(rho1), ts1, pa, e1);
+	k_s2 = eb_efcon(KTS(rho2), ts2, pa, e2);
+
+	return eb_ssxfr(k_s1, k_s2, ts1, ts2, ds1, ds2);
+}
+
+/* ----------------------------------------------------------------------- */
+
+static inline double
+eb_heat_stor(
+	double	cp,	/* specific heat of layer (J/kg K) */
+	double	spm,	/* layer specific mass (kg/m^2)    */
+	double	tdif)	/* temperature change (K)          */
+{
+	return cp * spm * tdif;
+}
+
+/*
+ * net allwave radiation (W/m^2) at the snow surface
+ */
+static inline double
+eb_net_rad(
+		double	S_n,	/* net solar radiation (W/m^2)		*/
+		double	I_lw,	/* incoming longwave (W/m^2)		*/
+		double	T_s_0)	/* active snow layer temperature (K)	*/
+{
+	return S_n + (SNOW_EMISSIVITY * (I_lw - STEF_BOLTZ * pow(T_s_0, 4)));
+}
+
+/*
+ * advected energy (W/m^2) from the precipitation of a timestep
+ */
+static inline double
+eb_advec(
+		int	precip_now,
+		double	m_rain,	/* specific mass of rain (kg/m^2)	*/
+		double	T_rain,	/* rain temperature (K)			*/
+		double	m_snow,	/* specific mass of snow (kg/m^2)	*/
+		double	T_snow,	/* snow temperature (K)			*/
+		double	T_s_0,	/* active snow layer temperature (K)	*/
+		double	time_step)	/* timestep (sec)		*/
+{
+	if (! precip_now)
+		return 0.0;
+
+	return (eb_heat_stor(CP_WATER(T_rain), m_rain, (T_rain - T_s_0)) +
+		eb_heat_stor(CP_ICE(T_snow), m_snow, (T_snow - T_s_0)))
+		/ time_step;
+}
+
+#endif  /* _PRIV_E_BAL_H_ */
@@ -13,11 +13,20 @@
  **	snowcover.
  **
  ** GLOBAL VARIABLES READ
+ **	warm_start
  **
  ** GLOBAL VARIABLES MODIFIED
+ **	obukhov_lo
+ **	hle1_calls
+ **	hle1_iters
  **
+ **	With warm_start, hle1 starts from the Obukhov length of the previous
+ **	call for this pixel, and falls back to a neutral (cold) start if
+ **	that does not converge.
  */
 
+#include        <math.h>
+
 //#include        "ipw.h"
 #include        "_snobal.h"
 #include        "envphys.h"
@@ -31,6 +40,10 @@ _h_le(void)
 			     height) above snow surface */
 	double	rel_z_u;  /* relative z_u (windspeed measurement
 			     height) above snow surface */
+	double	lo;	  /* Obukhov stability length */
+	int	iters;	  /* # of hle1 iterations */
+	int	warm;	  /* starting from the last Obukhov length? */
+	int	ier;
 
 	/* calculate saturation vapor pressure */
 	//	printf("-Ts0 %f Ta %f-", T_s_0, T_a);
@@ -59,13 +72,31 @@ _h_le(void)
 
 	/* calculate H & L_v_E */
 
-	if (hle1 (P_a, T_a, T_s_0, rel_z_T, e_a, e_s, rel_z_T, u,
-			rel_z_u, z_0, &H, &L_v_E, &E) != 0) {
+	warm = warm_start && isfinite(obukhov_lo) && obukhov_lo != 0;
+	lo = warm? obukhov_lo : HUGE_VAL;
+
+	ier = hle1_warm (P_a, T_a, T_s_0, rel_z_T, e_a, e_s, rel_z_T, u,
+			rel_z_u, z_0, &lo, &iters, &H, &L_v_E, &E);
+	hle1_calls++;
+	hle1_iters += iters;
+
+	/* cold start if the warm start did not converge */
+	if (ier == -1 && warm) {
+		lo = HUGE_VAL;
+		ier = hle1_warm (P_a, T_a, T_s_0, rel_z_T, e_a, e_s, rel_z_T, u,
+				rel_z_u, z_0, &lo, &iters, &H, &L_v_E, &E);
+		hle1_calls++;
+		hle1_iters += iters;
+	}
+
+	if (ier != 0) {
+		obukhov_lo = HUGE_VAL;
 //		usrerr("hle1 did not converge\nP_a %f, T_a %f, T_s_0 %f\nrelative z_T %f, e_a %f, e_s %f\nu %f, relative z_u %f, z_0 %f\n", P_a, T_a, T_s_0, rel_z_T, e_a, e_s, u, rel_z_u, z_0);
 		fprintf(stderr, "hle1 did not converge\nP_a %f, T_a %f, T_s_0 %f\nrelative z_T %f, e_a %f, e_s %f\nu %f, relative z_u %f, z_0 %f\n", P_a, T_a, T_s_0, rel_z_T, e_a, e_s, u, rel_z_u, z_0);
 
 		return FALSE;
 	}
 
+	obukhov_lo = lo;
 	return TRUE;
 }
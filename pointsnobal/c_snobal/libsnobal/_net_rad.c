@@ -29,9 +29,10 @@
 #include "_snobal.h"
 #include "snow.h"
 #include "radiation.h"
+#include "_e_bal.h"
 
 void
 _net_rad(void)
 {
-	R_n = S_n + (SNOW_EMISSIVITY * (I_lw - STEF_BOLTZ * pow(T_s_0, 4)));
+	R_n = eb_net_rad(S_n, I_lw, T_s_0);
 }
@@ -3,6 +3,7 @@
  */
 
 #include <stdio.h>
+#include <stdlib.h>
 
 #include <math.h>
 #include <string.h>
@@ -11,40 +12,214 @@
 #include "envphys.h"
 #include "pointsnobal.h"
 
-int call_snobal (
-		int N,
-		int nthreads,
+
+/*
+ * Run one data timestep for pixel n, reading and writing its state in output1
+ */
+static void _run_pixel (
+		int n,
 		int first_step,
-		TSTEP_REC tstep[4],
-		//OUTPUT_REC** output_rec,
 		INPUT_REC_ARR* input1,
 		INPUT_REC_ARR* input2,
-		PARAMS params,
 		OUTPUT_REC_ARR* output1
 )
 {
-	int n;
-	//	double current_time, time_since_out;
-	//	double data_tstep;
 
+	/* initialize some global variables for
+   'snobal' library for each pass since
+   the routine 'do_data_tstep' modifies them */
+
+	current_time = output1->current_time[n];//output_rec[n]->current_time;
+	time_since_out = output1->time_since_out[n];//output_rec[n]->time_since_out;
+
+	// get the input records
+	input_rec1.I_lw = input1->I_lw[n];
+	input_rec1.T_a  = input1->T_a[n];
+	input_rec1.e_a  = input1->e_a[n];
+	input_rec1.u    = input1->u[n];
+	input_rec1.T_g  = input1->T_g[n];
+	input_rec1.S_n  = input1->S_n[n];
+
+	input_rec2.I_lw = input2->I_lw[n];
+	input_rec2.T_a  = input2->T_a[n];
+	input_rec2.e_a  = input2->e_a[n];
+	input_rec2.u    = input2->u[n];
+	input_rec2.T_g  = input2->T_g[n];
+	input_rec2.S_n  = input2->S_n[n];
+
+
+	// precip inputs
+	m_pp         = input1->m_pp[n];
+	percent_snow = input1->percent_snow[n];
+	rho_snow     = input1->rho_snow[n];
+	T_pp         = input1->T_pp[n];
+
+	precip_now = 0;
+	if (m_pp > 0)
+		precip_now = 1;
+
+
+	/* extract data from I/O buffers */
+	double elevation    = output1->elevation[n];//output_rec[n]->elevation;
+
+	z_0 = output1->z_0[n];//z_0	     	 = output_rec[n]->z_0;
+	z_s = output1->z_s[n];//z_s          = output_rec[n]->z_s;
+	rho	     	 = output1->rho[n];//output_rec[n]->rho;
+
+	T_s_0	     = output1->T_s_0[n];//output_rec[n]->T_s_0;
+	T_s_l	     = output1->T_s_l[n];//output_rec[n]->T_s_l;
+	T_s	         = output1->T_s[n];//output_rec[n]->T_s;
+	h2o_sat	     = output1->h2o_sat[n];//output_rec[n]->h2o_sat;
+	layer_count  = output1->layer_count[n];//output_rec[n]->layer_count;
+
+	R_n_bar	     = output1->R_n_bar[n];//output_rec[n]->R_n_bar;
+	H_bar	     = output1->H_bar[n];//output_rec[n]->H_bar;
+	L_v_E_bar    = output1->L_v_E_bar[n];//output_rec[n]->L_v_E_bar;
+	G_bar	     = output1->G_bar[n];//output_rec[n]->G_bar;
+	M_bar	     = output1->M_bar[n];//output_rec[n]->M_bar;
+	delta_Q_bar  = output1->delta_Q_bar[n];//output_rec[n]->delta_Q_bar;
+	E_s_sum      = output1->E_s_sum[n];//output_rec[n]->E_s_sum;
+	melt_sum     = output1->melt_sum[n];//output_rec[n]->melt_sum;
+	ro_pred_sum  = output1->ro_pred_sum[n];//output_rec[n]->ro_pred_sum;
+	obukhov_lo   = output1->obukhov_lo[n];
+
+	/* establish conditions for snowpack */
+	if (first_step == 1) {
+		init_snow();
+		R_n_bar	     = 0.0;
+		H_bar	     = 0.0;
+		L_v_E_bar    = 0.0;
+		G_bar	     = 0.0;
+		M_bar	     = 0.0;
+		delta_Q_bar  = 0.0;
+		E_s_sum      = 0.0;
+		melt_sum     = 0.0;
+		ro_pred_sum  = 0.0;
+	} else {
+		init_snow();
+		// pull the rest of the snowpack information out of the structure
+		// z_s_0 = output1->z_s_0[n];//z_s_0		= output_rec[n]->z_s_0;
+		// z_s_l		= output1->z_s_l[n];//output_rec[n]->z_s_l;
+		// m_s			= output1->m_s[n];//output_rec[n]->m_s;
+		// m_s_0		= output1->m_s_0[n];//output_rec[n]->m_s_0;
+		// m_s_l		= output1->m_s_l[n];//output_rec[n]->m_s_l;
+		// cc_s		= output1->cc_s[n];//output_rec[n]->cc_s;
+		// cc_s_0		= output1->cc_s_0[n];//output_rec[n]->cc_s_0;
+		// cc_s_l		= output1->cc_s_l[n];//output_rec[n]->cc_s_l;
+		// h2o_vol		= output1->h2o_vol[n];//output_rec[n]->h2o_vol;
+		// h2o			= output1->h2o[n];//output_rec[n]->h2o;
+		// h2o_max		= output1->h2o_max[n];//output_rec[n]->h2o_max;
+		// h2o_total	= output1->h2o_total[n];//output_rec[n]->h2o_total;
+	}
 
-	// Some debuging stuff
-	//	printf("%i\n", tstep_info[1].level);
-	//		printf("%f - %f - %f - %f - %f - %f\n", input1->S_n[0], input1->I_lw[0], input1->T_a[0], input1->e_a[0], input1->u[0], input1->T_g[0]);
-	//	printf ("%i -- %f\n", N, output_rec[0]->elevation);
+	//				printf("Mass %f\n", m_s);
+
+	/* set air pressure from site elev */
+
+	// P_a = HYSTAT(SEA_LEVEL, STD_AIRTMP, STD_LAPSE, (output_rec[n]->elevation / 1000.0),
+	// 		GRAVITY, MOL_AIR);
+	P_a = HYSTAT(SEA_LEVEL, STD_AIRTMP, STD_LAPSE, (output1->elevation[n] / 1000.0),
+			GRAVITY, MOL_AIR);
+
+	/* run model on data for this pixel */
+	//printf("m_s = %f, rho = %f\n", m_s, rho);
+	if (! do_data_tstep())
+		fprintf(stderr, "Error at pixel %i", n);
+	//printf("m_s = %f, rho = %f, N = %d, n=%d\n", m_s, rho, N, n);
+	/* assign data to output buffers */
+	//			current_time += data_tstep;
+	// output_rec[n]->current_time = current_time;
+	// output_rec[n]->time_since_out = time_since_out;
+	//
+	// //			output_rec[n]->elevation = elevation;
+	// output_rec[n]->z_0 = z_0;
+	// output_rec[n]->rho = rho;
+	// output_rec[n]->T_s_0 = T_s_0;
+	// output_rec[n]->T_s_l = T_s_l;
+	// output_rec[n]->T_s = T_s;
+	// output_rec[n]->h2o_sat = h2o_sat;
+	// output_rec[n]->h2o_max = h2o_max;
+	// output_rec[n]->h2o = h2o;
+	// output_rec[n]->h2o_vol = h2o_vol;
+	// output_rec[n]->h2o_total = h2o_total;
+	// output_rec[n]->layer_count = layer_count;
+	// output_rec[n]->cc_s_0 = cc_s_0;
+	// output_rec[n]->cc_s_l = cc_s_l;
+	// output_rec[n]->cc_s = cc_s;
+	// output_rec[n]->m_s_0 = m_s_0;
+	// output_rec[n]->m_s_l = m_s_l;
+	// output_rec[n]->m_s = m_s;
+	// output1->z_0[n] = z_0;//output_rec[n]->z_s_0 = z_s_0;
+	// output_rec[n]->z_s_l = z_s_l;
+	// output1->z_s_0[n] = z_s_0;//output_rec[n]->z_s = z_s;
+	//
+	// output_rec[n]->R_n_bar = R_n_bar;
+	// output_rec[n]->H_bar = H_bar;
+	// output_rec[n]->L_v_E_bar = L_v_E_bar;
+	// output_rec[n]->G_bar = G_bar;
+	// output_rec[n]->G_0_bar = G_0_bar;
+	// output_rec[n]->M_bar = M_bar;
+	// output_rec[n]->delta_Q_bar = delta_Q_bar;
+	// output_rec[n]->delta_Q_0_bar = delta_Q_0_bar;
+	// output_rec[n]->E_s_sum = E_s_sum;
+	// output_rec[n]->melt_sum = melt_sum;
+	// output_rec[n]->ro_pred_sum = ro_pred_sum;
+
+	output1->current_time[n] = current_time;
+	output1->time_since_out[n] = time_since_out;
+
+	// output1->elevation[n] = elevation;
+	output1->rho[n] = rho;
+	output1->T_s_0[n] = T_s_0;
+	output1->T_s_l[n] = T_s_l;
+	output1->T_s[n] = T_s;
+	output1->h2o_sat[n] = h2o_sat;
+	output1->h2o_max[n] = h2o_max;
+	output1->h2o[n] = h2o;
+	output1->h2o_vol[n] = h2o_vol;
+	output1->h2o_total[n] = h2o_total;
+	output1->layer_count[n] = layer_count;
+	output1->cc_s_0[n] = cc_s_0;
+	output1->cc_s_l[n] = cc_s_l;
+	output1->cc_s[n] = cc_s;
+	output1->m_s_0[n] = m_s_0;
+	output1->m_s_l[n] = m_s_l;
+	output1->m_s[n] = m_s;
+	output1->z_0[n] = z_0;//output_rec[n]->z_s_0 = z_s_0;
+	output1->z_s_l[n] = z_s_l;
+	output1->z_s_0[n] = z_s_0;//output_rec[n]->z_s = z_s;
+	output1->z_s[n] = z_s;//output_rec[n]->z_s = z_s;
+
+	output1->R_n_bar[n] = R_n_bar;
+	output1->H_bar[n] = H_bar;
+	output1->L_v_E_bar[n] = L_v_E_bar;
+	output1->G_bar[n] = G_bar;
+	output1->G_0_bar[n] = G_0_bar;
+	output1->M_bar[n] = M_bar;
+	output1->delta_Q_bar[n] = delta_Q_bar;
+	output1->delta_Q_0_bar[n] = delta_Q_0_bar;
+	output1->E_s_sum[n] = E_s_sum;
+	output1->melt_sum[n] = melt_sum;
+	output1->ro_pred_sum[n] = ro_pred_sum;
+	output1->obukhov_lo[n] = obukhov_lo;
+}
 
-	/* set threads */
-	if (nthreads != 1) {
-		omp_set_num_threads(nthreads); 	// Use N threads for all consecutive parallel regions
-	}
+/*
+ * Copy the timestep info and parameters into the globals that are
+ * copied in to each thread
+ */
+static void _set_globals (
+		TSTEP_REC tstep[4],
+		PARAMS params
+)
+{
+	int n;
 
 	// for some reason, C compiler doen't let you threadprivate the tstep since it's already created.
 	// Therefore, we need to create a pointer to it, apply threadprivate, then copy in the data from the input
 	for (n = 0; n < 4; n++)
 		tstep_info[n] = tstep[n];
 
-	//	data_tstep = tstep_info[DATA_TSTEP].time_step;
-
 	// pull out the parameters
 	z_u = params.z_u;
 	z_T = params.z_T;
@@ -52,207 +227,559 @@ int call_snobal (
 	relative_hts = params.relative_heights;
 	max_z_s_0 = params.max_z_s_0;
 	max_h2o_vol = params.max_h2o_vol;
+	warm_start = params.warm_start;
+}
+
+/*
+ * Add this thread's hle1 counts to the totals, call at the end of a
+ * parallel region
+ */
+static long hle1_calls_total = 0;
+static long hle1_iters_total = 0;
+
+static void _flush_counters (void)
+{
+#pragma omp atomic
+	hle1_calls_total += hle1_calls;
+#pragma omp atomic
+	hle1_iters_total += hle1_iters;
+	hle1_calls = 0;
+	hle1_iters = 0;
+}
+
+/*
+ * Total hle1 calls and iterations since the last reset
+ */
+void hle1_counters (
+		long *calls,
+		long *iters,
+		int reset
+)
+{
+	*calls = hle1_calls_total;
+	*iters = hle1_iters_total;
+	if (reset) {
+		hle1_calls_total = 0;
+		hle1_iters_total = 0;
+	}
+}
+
+int call_snobal (
+		int N,
+		int nthreads,
+		int first_step,
+		TSTEP_REC tstep[4],
+		//OUTPUT_REC** output_rec,
+		INPUT_REC_ARR* input1,
+		INPUT_REC_ARR* input2,
+		PARAMS params,
+		OUTPUT_REC_ARR* output1
+)
+{
+	int n;
+	//	double current_time, time_since_out;
+	//	double data_tstep;
 
-	//	printf("%i -- %i -- %f -- %f\n", tstep_info[0].level, tstep_info[0].time_step, tstep_info[0].intervals, tstep_info[0].threshold);
-	//	printf("%i -- %i -- %f -- %f\n", tstep_info[1].level, tstep_info[1].time_step, tstep_info[1].intervals, tstep_info[1].threshold);
-	//	printf("%i -- %i -- %f -- %f\n", tstep_info[2].level, tstep_info[2].time_step, tstep_info[2].intervals, tstep_info[2].threshold);
-	//	printf("%i -- %i -- %f -- %f\n", tstep_info[3].level, tstep_info[3].time_step, tstep_info[3].intervals, tstep_info[3].threshold);
 
-//#pragma omp parallel shared(output_rec, input1, input2, first_step)
-#pragma omp parallel shared(output1, input1, input2, first_step)\
+	// Some debuging stuff
+	//	printf("%i\n", tstep_info[1].level);
+	//		printf("%f - %f - %f - %f - %f - %f\n", input1->S_n[0], input1->I_lw[0], input1->T_a[0], input1->e_a[0], input1->u[0], input1->T_g[0]);
+	//	printf ("%i -- %f\n", N, output_rec[0]->elevation);
+
+	_set_globals(tstep, params);
+
+#pragma omp parallel num_threads(nthreads) \
+		shared(output1, input1, input2, first_step) \
 		private(n) \
-		copyin(tstep_info, z_u, z_T, z_g, relative_hts, max_z_s_0, max_h2o_vol)
+		copyin(tstep_info, z_u, z_T, z_g, relative_hts, max_z_s_0, max_h2o_vol, warm_start)
 	{
 #pragma omp for schedule(dynamic, 100)
 		for (n = 0; n < N; n++) {
+			if (output1->masked[n] == 1)
+				_run_pixel(n, first_step, input1, input2, output1);
+		}  /* for loop on grid */
 
-			//if (output_rec[n]->masked == 1) {
-			if (output1->masked[n] == 1) {
-
-				/* initialize some global variables for
-			   'snobal' library for each pass since
-			   the routine 'do_data_tstep' modifies them */
-
-				current_time = output1->current_time[n];//output_rec[n]->current_time;
-				time_since_out = output1->time_since_out[n];//output_rec[n]->time_since_out;
-
-				// get the input records
-				input_rec1.I_lw = input1->I_lw[n];
-				input_rec1.T_a  = input1->T_a[n];
-				input_rec1.e_a  = input1->e_a[n];
-				input_rec1.u    = input1->u[n];
-				input_rec1.T_g  = input1->T_g[n];
-				input_rec1.S_n  = input1->S_n[n];
-
-				input_rec2.I_lw = input2->I_lw[n];
-				input_rec2.T_a  = input2->T_a[n];
-				input_rec2.e_a  = input2->e_a[n];
-				input_rec2.u    = input2->u[n];
-				input_rec2.T_g  = input2->T_g[n];
-				input_rec2.S_n  = input2->S_n[n];
-
-
-				// precip inputs
-				m_pp         = input1->m_pp[n];
-				percent_snow = input1->percent_snow[n];
-				rho_snow     = input1->rho_snow[n];
-				T_pp         = input1->T_pp[n];
-
-				precip_now = 0;
-				if (m_pp > 0)
-					precip_now = 1;
-
-
-				/* extract data from I/O buffers */
-				double elevation    = output1->elevation[n];//output_rec[n]->elevation;
-
-				z_0 = output1->z_0[n];//z_0	     	 = output_rec[n]->z_0;
-				z_s = output1->z_s[n];//z_s          = output_rec[n]->z_s;
-				rho	     	 = output1->rho[n];//output_rec[n]->rho;
-
-				T_s_0	     = output1->T_s_0[n];//output_rec[n]->T_s_0;
-				T_s_l	     = output1->T_s_l[n];//output_rec[n]->T_s_l;
-				T_s	         = output1->T_s[n];//output_rec[n]->T_s;
-				h2o_sat	     = output1->h2o_sat[n];//output_rec[n]->h2o_sat;
-				layer_count  = output1->layer_count[n];//output_rec[n]->layer_count;
-
-				R_n_bar	     = output1->R_n_bar[n];//output_rec[n]->R_n_bar;
-				H_bar	     = output1->H_bar[n];//output_rec[n]->H_bar;
-				L_v_E_bar    = output1->L_v_E_bar[n];//output_rec[n]->L_v_E_bar;
-				G_bar	     = output1->G_bar[n];//output_rec[n]->G_bar;
-				M_bar	     = output1->M_bar[n];//output_rec[n]->M_bar;
-				delta_Q_bar  = output1->delta_Q_bar[n];//output_rec[n]->delta_Q_bar;
-				E_s_sum      = output1->E_s_sum[n];//output_rec[n]->E_s_sum;
-				melt_sum     = output1->melt_sum[n];//output_rec[n]->melt_sum;
-				ro_pred_sum  = output1->ro_pred_sum[n];//output_rec[n]->ro_pred_sum;
-
-				/* establish conditions for snowpack */
-				if (first_step == 1) {
-					init_snow();
-					R_n_bar	     = 0.0;
-					H_bar	     = 0.0;
-					L_v_E_bar    = 0.0;
-					G_bar	     = 0.0;
-					M_bar	     = 0.0;
-					delta_Q_bar  = 0.0;
-					E_s_sum      = 0.0;
-					melt_sum     = 0.0;
-					ro_pred_sum  = 0.0;
-				} else {
-					init_snow();
-					// pull the rest of the snowpack information out of the structure
-					// z_s_0 = output1->z_s_0[n];//z_s_0		= output_rec[n]->z_s_0;
-					// z_s_l		= output1->z_s_l[n];//output_rec[n]->z_s_l;
-					// m_s			= output1->m_s[n];//output_rec[n]->m_s;
-					// m_s_0		= output1->m_s_0[n];//output_rec[n]->m_s_0;
-					// m_s_l		= output1->m_s_l[n];//output_rec[n]->m_s_l;
-					// cc_s		= output1->cc_s[n];//output_rec[n]->cc_s;
-					// cc_s_0		= output1->cc_s_0[n];//output_rec[n]->cc_s_0;
-					// cc_s_l		= output1->cc_s_l[n];//output_rec[n]->cc_s_l;
-					// h2o_vol		= output1->h2o_vol[n];//output_rec[n]->h2o_vol;
-					// h2o			= output1->h2o[n];//output_rec[n]->h2o;
-					// h2o_max		= output1->h2o_max[n];//output_rec[n]->h2o_max;
-					// h2o_total	= output1->h2o_total[n];//output_rec[n]->h2o_total;
-				}
+		_flush_counters();
+	}
+
+	return -1;
+
+}
+
+/*
+ * Copy the state of pixel i in from to index j in to
+ */
+static void _copy_state (
+		OUTPUT_REC_ARR* from,
+		int i,
+		OUTPUT_REC_ARR* to,
+		int j
+)
+{
+	to->masked[j] = from->masked[i];
+	to->current_time[j] = from->current_time[i];
+	to->time_since_out[j] = from->time_since_out[i];
+	to->elevation[j] = from->elevation[i];
+	to->z_0[j] = from->z_0[i];
+	to->rho[j] = from->rho[i];
+	to->T_s_0[j] = from->T_s_0[i];
+	to->T_s_l[j] = from->T_s_l[i];
+	to->T_s[j] = from->T_s[i];
+	to->h2o_sat[j] = from->h2o_sat[i];
+	to->h2o_max[j] = from->h2o_max[i];
+	to->h2o_vol[j] = from->h2o_vol[i];
+	to->h2o[j] = from->h2o[i];
+	to->h2o_total[j] = from->h2o_total[i];
+	to->layer_count[j] = from->layer_count[i];
+	to->cc_s_0[j] = from->cc_s_0[i];
+	to->cc_s_l[j] = from->cc_s_l[i];
+	to->cc_s[j] = from->cc_s[i];
+	to->m_s_0[j] = from->m_s_0[i];
+	to->m_s_l[j] = from->m_s_l[i];
+	to->m_s[j] = from->m_s[i];
+	to->z_s_0[j] = from->z_s_0[i];
+	to->z_s_l[j] = from->z_s_l[i];
+	to->z_s[j] = from->z_s[i];
+	to->R_n_bar[j] = from->R_n_bar[i];
+	to->H_bar[j] = from->H_bar[i];
+	to->L_v_E_bar[j] = from->L_v_E_bar[i];
+	to->G_bar[j] = from->G_bar[i];
+	to->G_0_bar[j] = from->G_0_bar[i];
+	to->M_bar[j] = from->M_bar[i];
+	to->delta_Q_bar[j] = from->delta_Q_bar[i];
+	to->delta_Q_0_bar[j] = from->delta_Q_0_bar[i];
+	to->E_s_sum[j] = from->E_s_sum[i];
+	to->melt_sum[j] = from->melt_sum[i];
+	to->ro_pred_sum[j] = from->ro_pred_sum[i];
+	to->obukhov_lo[j] = from->obukhov_lo[i];
+}
+
+/*
+ * Free the state buffers from _alloc_state
+ */
+static void _free_state (
+		OUTPUT_REC_ARR* state
+)
+{
+	free(state->masked);
+	free(state->current_time);
+	free(state->time_since_out);
+	free(state->elevation);
+	free(state->z_0);
+	free(state->rho);
+	free(state->T_s_0);
+	free(state->T_s_l);
+	free(state->T_s);
+	free(state->h2o_sat);
+	free(state->h2o_max);
+	free(state->h2o_vol);
+	free(state->h2o);
+	free(state->h2o_total);
+	free(state->layer_count);
+	free(state->cc_s_0);
+	free(state->cc_s_l);
+	free(state->cc_s);
+	free(state->m_s_0);
+	free(state->m_s_l);
+	free(state->m_s);
+	free(state->z_s_0);
+	free(state->z_s_l);
+	free(state->z_s);
+	free(state->R_n_bar);
+	free(state->H_bar);
+	free(state->L_v_E_bar);
+	free(state->G_bar);
+	free(state->G_0_bar);
+	free(state->M_bar);
+	free(state->delta_Q_bar);
+	free(state->delta_Q_0_bar);
+	free(state->E_s_sum);
+	free(state->melt_sum);
+	free(state->ro_pred_sum);
+	free(state->obukhov_lo);
+}
+
+/*
+ * Allocate, but do not touch, state buffers for N pixels. The pages are
+ * placed on a NUMA node by the first thread that writes to them.
+ * Returns FALSE if any allocation failed.
+ */
+static int _alloc_state (
+		OUTPUT_REC_ARR* state,
+		int N
+)
+{
+	size_t nd = N * sizeof(double);
+	size_t ni = N * sizeof(int);
+
+	state->masked = malloc(ni);
+	state->current_time = malloc(nd);
+	state->time_since_out = malloc(nd);
+	state->elevation = malloc(nd);
+	state->z_0 = malloc(nd);
+	state->rho = malloc(nd);
+	state->T_s_0 = malloc(nd);
+	state->T_s_l = malloc(nd);
+	state->T_s = malloc(nd);
+	state->h2o_sat = malloc(nd);
+	state->h2o_max = malloc(nd);
+	state->h2o_vol = malloc(nd);
+	state->h2o = malloc(nd);
+	state->h2o_total = malloc(nd);
+	state->layer_count = malloc(ni);
+	state->cc_s_0 = malloc(nd);
+	state->cc_s_l = malloc(nd);
+	state->cc_s = malloc(nd);
+	state->m_s_0 = malloc(nd);
+	state->m_s_l = malloc(nd);
+	state->m_s = malloc(nd);
+	state->z_s_0 = malloc(nd);
+	state->z_s_l = malloc(nd);
+	state->z_s = malloc(nd);
+	state->R_n_bar = malloc(nd);
+	state->H_bar = malloc(nd);
+	state->L_v_E_bar = malloc(nd);
+	state->G_bar = malloc(nd);
+	state->G_0_bar = malloc(nd);
+	state->M_bar = malloc(nd);
+	state->delta_Q_bar = malloc(nd);
+	state->delta_Q_0_bar = malloc(nd);
+	state->E_s_sum = malloc(nd);
+	state->melt_sum = malloc(nd);
+	state->ro_pred_sum = malloc(nd);
+	state->obukhov_lo = malloc(nd);
+
+	if (!state->masked || !state->current_time || !state->time_since_out ||
+			!state->elevation || !state->z_0 || !state->rho ||
+			!state->T_s_0 || !state->T_s_l || !state->T_s ||
+			!state->h2o_sat || !state->h2o_max || !state->h2o_vol ||
+			!state->h2o || !state->h2o_total || !state->layer_count ||
+			!state->cc_s_0 || !state->cc_s_l || !state->cc_s ||
+			!state->m_s_0 || !state->m_s_l || !state->m_s ||
+			!state->z_s_0 || !state->z_s_l || !state->z_s ||
+			!state->R_n_bar || !state->H_bar || !state->L_v_E_bar ||
+			!state->G_bar || !state->G_0_bar || !state->M_bar ||
+			!state->delta_Q_bar || !state->delta_Q_0_bar ||
+			!state->E_s_sum || !state->melt_sum || !state->ro_pred_sum ||
+			!state->obukhov_lo) {
+		_free_state(state);
+		return FALSE;
+	}
+
+	return TRUE;
+}
+
+/*
+ * Point input1 at the inputs starting at offset of a [T, N] input series
+ */
+static void _input_at (
+		INPUT_REC_ARR* inputs,
+		int offset,
+		INPUT_REC_ARR* input1
+)
+{
+	input1->S_n = inputs->S_n + offset;
+	input1->I_lw = inputs->I_lw + offset;
+	input1->T_a = inputs->T_a + offset;
+	input1->e_a = inputs->e_a + offset;
+	input1->u = inputs->u + offset;
+	input1->T_g = inputs->T_g + offset;
+	input1->m_pp = inputs->m_pp + offset;
+	input1->percent_snow = inputs->percent_snow + offset;
+	input1->rho_snow = inputs->rho_snow + offset;
+	input1->T_pp = inputs->T_pp + offset;
+}
+
+/*
+ * State array for the aggregated quantity var. Fluxes and mass totals
+ * come from their running means and sums since the last output.
+ */
+static double* _agg_array (
+		OUTPUT_REC_ARR* s,
+		int var
+)
+{
+	switch (var) {
+	case AGG_T_s_0:		return s->T_s_0;
+	case AGG_T_s_l:		return s->T_s_l;
+	case AGG_T_s:		return s->T_s;
+	case AGG_z_s:		return s->z_s;
+	case AGG_rho:		return s->rho;
+	case AGG_m_s:		return s->m_s;
+	case AGG_h2o:		return s->h2o;
+	case AGG_h2o_sat:	return s->h2o_sat;
+	case AGG_cc_s:		return s->cc_s;
+	case AGG_R_n:		return s->R_n_bar;
+	case AGG_H:		return s->H_bar;
+	case AGG_L_v_E:		return s->L_v_E_bar;
+	case AGG_G:		return s->G_bar;
+	case AGG_M:		return s->M_bar;
+	case AGG_delta_Q:	return s->delta_Q_bar;
+	case AGG_G_0:		return s->G_0_bar;
+	case AGG_delta_Q_0:	return s->delta_Q_0_bar;
+	case AGG_E_s:		return s->E_s_sum;
+	case AGG_melt:		return s->melt_sum;
+	default:		return s->ro_pred_sum;
+	}
+}
+
+/*
+ * Save the accumulators of pixel n before data timestep t. They are
+ * zeroed on the first timestep.
+ */
+static void _agg_start (
+		int n_aggs,
+		AGGREGATOR* aggs,
+		OUTPUT_REC_ARR* s,
+		int n,
+		int t,
+		double* before
+)
+{
+	int a;
+
+	for (a = 0; a < n_aggs; a++)
+		before[a] = (t == 1)? 0.0 : _agg_array(s, aggs[a].var)[n];
+}
+
+/*
+ * Is var defined for a pixel with layer_count layers? The snow
+ * temperatures, density and saturation hold fill values without snow,
+ * and T_s_l without a lower layer.
+ */
+static int _agg_defined (
+		int var,
+		int layer_count
+)
+{
+	switch (var) {
+	case AGG_T_s_0:
+	case AGG_T_s:
+	case AGG_rho:
+	case AGG_h2o_sat:	return layer_count > 0;
+	case AGG_T_s_l:		return layer_count == 2;
+	default:		return TRUE;
+	}
+}
+
+/*
+ * Value of var over the data timestep just run for pixel n, given the
+ * time since output (tso0) and accumulator (before) from the start of it
+ */
+static double _agg_value (
+		int var,
+		OUTPUT_REC_ARR* s,
+		int n,
+		double tso0,
+		double before
+)
+{
+	double now = _agg_array(s, var)[n];
+	double tso1 = s->time_since_out[n];
+
+	/* state at the end of the timestep, or accumulators restarted */
+	if (var < AGG_FIRST_FLUX || tso0 <= 0.0)
+		return now;
 
-				//				printf("Mass %f\n", m_s);
-
-				/* set air pressure from site elev */
-
-				// P_a = HYSTAT(SEA_LEVEL, STD_AIRTMP, STD_LAPSE, (output_rec[n]->elevation / 1000.0),
-				// 		GRAVITY, MOL_AIR);
-				P_a = HYSTAT(SEA_LEVEL, STD_AIRTMP, STD_LAPSE, (output1->elevation[n] / 1000.0),
-						GRAVITY, MOL_AIR);
-
-				/* run model on data for this pixel */
-				//printf("m_s = %f, rho = %f\n", m_s, rho);
-				if (! do_data_tstep())
-					fprintf(stderr, "Error at pixel %i", n);
-				//printf("m_s = %f, rho = %f, N = %d, n=%d\n", m_s, rho, N, n);
-				/* assign data to output buffers */
-				//			current_time += data_tstep;
-				// output_rec[n]->current_time = current_time;
-				// output_rec[n]->time_since_out = time_since_out;
-				//
-				// //			output_rec[n]->elevation = elevation;
-				// output_rec[n]->z_0 = z_0;
-				// output_rec[n]->rho = rho;
-				// output_rec[n]->T_s_0 = T_s_0;
-				// output_rec[n]->T_s_l = T_s_l;
-				// output_rec[n]->T_s = T_s;
-				// output_rec[n]->h2o_sat = h2o_sat;
-				// output_rec[n]->h2o_max = h2o_max;
-				// output_rec[n]->h2o = h2o;
-				// output_rec[n]->h2o_vol = h2o_vol;
-				// output_rec[n]->h2o_total = h2o_total;
-				// output_rec[n]->layer_count = layer_count;
-				// output_rec[n]->cc_s_0 = cc_s_0;
-				// output_rec[n]->cc_s_l = cc_s_l;
-				// output_rec[n]->cc_s = cc_s;
-				// output_rec[n]->m_s_0 = m_s_0;
-				// output_rec[n]->m_s_l = m_s_l;
-				// output_rec[n]->m_s = m_s;
-				// output1->z_0[n] = z_0;//output_rec[n]->z_s_0 = z_s_0;
-				// output_rec[n]->z_s_l = z_s_l;
-				// output1->z_s_0[n] = z_s_0;//output_rec[n]->z_s = z_s;
-				//
-				// output_rec[n]->R_n_bar = R_n_bar;
-				// output_rec[n]->H_bar = H_bar;
-				// output_rec[n]->L_v_E_bar = L_v_E_bar;
-				// output_rec[n]->G_bar = G_bar;
-				// output_rec[n]->G_0_bar = G_0_bar;
-				// output_rec[n]->M_bar = M_bar;
-				// output_rec[n]->delta_Q_bar = delta_Q_bar;
-				// output_rec[n]->delta_Q_0_bar = delta_Q_0_bar;
-				// output_rec[n]->E_s_sum = E_s_sum;
-				// output_rec[n]->melt_sum = melt_sum;
-				// output_rec[n]->ro_pred_sum = ro_pred_sum;
-
-				output1->current_time[n] = current_time;
-				output1->time_since_out[n] = time_since_out;
-
-				// output1->elevation[n] = elevation;
-				output1->rho[n] = rho;
-				output1->T_s_0[n] = T_s_0;
-				output1->T_s_l[n] = T_s_l;
-				output1->T_s[n] = T_s;
-				output1->h2o_sat[n] = h2o_sat;
-				output1->h2o_max[n] = h2o_max;
-				output1->h2o[n] = h2o;
-				output1->h2o_vol[n] = h2o_vol;
-				output1->h2o_total[n] = h2o_total;
-				output1->layer_count[n] = layer_count;
-				output1->cc_s_0[n] = cc_s_0;
-				output1->cc_s_l[n] = cc_s_l;
-				output1->cc_s[n] = cc_s;
-				output1->m_s_0[n] = m_s_0;
-				output1->m_s_l[n] = m_s_l;
-				output1->m_s[n] = m_s;
-				output1->z_0[n] = z_0;//output_rec[n]->z_s_0 = z_s_0;
-				output1->z_s_l[n] = z_s_l;
-				output1->z_s_0[n] = z_s_0;//output_rec[n]->z_s = z_s;
-				output1->z_s[n] = z_s;//output_rec[n]->z_s = z_s;
-
-				output1->R_n_bar[n] = R_n_bar;
-				output1->H_bar[n] = H_bar;
-				output1->L_v_E_bar[n] = L_v_E_bar;
-				output1->G_bar[n] = G_bar;
-				output1->G_0_bar[n] = G_0_bar;
-				output1->M_bar[n] = M_bar;
-				output1->delta_Q_bar[n] = delta_Q_bar;
-				output1->delta_Q_0_bar[n] = delta_Q_0_bar;
-				output1->E_s_sum[n] = E_s_sum;
-				output1->melt_sum[n] = melt_sum;
-				output1->ro_pred_sum[n] = ro_pred_sum;
+	/* take the timestep out of the running mean or sum */
+	if (var < AGG_FIRST_MASS)
+		return (now * tso1 - before * tso0) / (tso1 - tso0);
+	return now - before;
+}
+
+/*
+ * Add data timestep t (1 to T - 1) of pixel n to each aggregator. Periods
+ * start at the first timestep, the last one may be shorter. Timesteps
+ * where the quantity is not defined are skipped, a period without any
+ * is NaN. count holds the timesteps taken so far in the current period
+ * of aggregator a for pixel n at a * N + n.
+ */
+static void _aggregate (
+		int n_aggs,
+		AGGREGATOR* aggs,
+		OUTPUT_REC_ARR* s,
+		int n,
+		int N,
+		int t,
+		int T,
+		double tso0,
+		double* before,
+		int* count
+)
+{
+	int a, i;
+	int* c;
+	double value;
+	double* out;
+
+	for (a = 0; a < n_aggs; a++) {
+		i = (t - 1) % aggs[a].period;
+		out = aggs[a].out + ((t - 1) / aggs[a].period) * N + n;
+		c = count + a * N + n;
+
+		if (i == 0) {
+			*out = NAN;
+			*c = 0;
+		}
+
+		if (_agg_defined(aggs[a].var, s->layer_count[n])) {
+			value = _agg_value(aggs[a].var, s, n, tso0, before[a]);
+
+			if (*c == 0) {
+				*out = value;
 			}
-		}  /* for loop on grid */
+			else if (aggs[a].stat == AGG_MIN) {
+				if (value < *out)
+					*out = value;
+			}
+			else if (aggs[a].stat == AGG_MAX) {
+				if (value > *out)
+					*out = value;
+			}
+			else {
+				*out += value;
+			}
+			(*c)++;
+		}
+
+		if (aggs[a].stat == AGG_MEAN && *c > 0 &&
+				(i == aggs[a].period - 1 || t == T - 1))
+			*out /= *c;
 	}
+}
 
+/*
+ * call_snobal_grid runs all T data timesteps of a [T, N] input series in a
+ * single parallel region. The thread team stays alive for the whole time
+ * loop and the timestep info and parameters are only copied in once.
+ *
+ * schedule and chunk set the OpenMP loop schedule over pixels
+ * (omp_sched_t values, chunk 0 for the default). With first_touch, each
+ * thread copies its pixels into freshly allocated state buffers so the
+ * pages sit on that thread's NUMA node; this needs a static schedule so
+ * pixels stay on the same thread every timestep.
+ *
+ * The state of every pixel is copied to outputs at each timestep t where
+ * out_steps[t] is set, output k going to index k * N + n.
+ *
+ * The n_aggs aggregators in aggs are updated after every data timestep,
+ * so sub-daily means, sums and extremes come out of the same run. Snow
+ * properties only take the timesteps with snow, see _agg_defined. Masked
+ * pixels are left as they are in the aggregator outputs.
+ *
+ * Returns -1 on success, like call_snobal, and 0 if allocation failed.
+ */
+int call_snobal_grid (
+		int N,
+		int T,
+		int nthreads,
+		int schedule,
+		int chunk,
+		int first_touch,
+		TSTEP_REC tstep[4],
+		INPUT_REC_ARR* inputs,
+		PARAMS params,
+		OUTPUT_REC_ARR* state,
+		int* out_steps,
+		OUTPUT_REC_ARR* outputs,
+		int n_aggs,
+		AGGREGATOR* aggs
+)
+{
+	OUTPUT_REC_ARR work;
+	OUTPUT_REC_ARR* s = state;
+	omp_sched_t old_kind;
+	int old_chunk;
+	double* agg_before = NULL;	/* accumulators at the start of a timestep, per thread */
+	int* agg_count = NULL;		/* timesteps in the current period, per pixel */
+
+	if (n_aggs > 0) {
+		agg_before = malloc(nthreads * n_aggs * sizeof(double));
+		agg_count = malloc((size_t) n_aggs * N * sizeof(int));
+		if (agg_before == NULL || agg_count == NULL) {
+			free(agg_before);
+			free(agg_count);
+			return 0;
+		}
+	}
 
+	if (first_touch) {
+		if (! _alloc_state(&work, N)) {
+			free(agg_before);
+			free(agg_count);
+			return 0;
+		}
+		s = &work;
+	}
 
+	_set_globals(tstep, params);
 
+	// the schedule is inherited by the team, restore it afterwards
+	omp_get_schedule(&old_kind, &old_chunk);
+	omp_set_schedule((omp_sched_t) schedule, chunk);
 
+#pragma omp parallel num_threads(nthreads) \
+		shared(s, state, inputs, out_steps, outputs, aggs, agg_before, agg_count) \
+		copyin(tstep_info, z_u, z_T, z_g, relative_hts, max_z_s_0, max_h2o_vol, warm_start)
+	{
+		int n, t;
+		int k = 0;
+		INPUT_REC_ARR input1, input2;
+		double tso0;
+		double* before = NULL;
+
+		if (n_aggs > 0)
+			before = agg_before + omp_get_thread_num() * n_aggs;
+
+		if (first_touch) {
+#pragma omp for schedule(runtime)
+			for (n = 0; n < N; n++)
+				_copy_state(state, n, s, n);
+		}
+
+		for (t = 1; t < T; t++) {
+			_input_at(inputs, (t - 1) * N, &input1);
+			_input_at(inputs, t * N, &input2);
+
+#pragma omp for schedule(runtime)
+			for (n = 0; n < N; n++) {
+				if (s->masked[n] == 1) {
+					tso0 = s->time_since_out[n];
+					if (before)
+						_agg_start(n_aggs, aggs, s, n, t, before);
+
+					_run_pixel(n, t, &input1, &input2, s);
+
+					if (before)
+						_aggregate(n_aggs, aggs, s, n, N, t, T,
+								tso0, before, agg_count);
+				}
 
-	return -1;
+				if (out_steps[t]) {
+					_copy_state(s, n, outputs, k * N + n);
+					s->time_since_out[n] = 0.0;
+				}
+			}  /* for loop on grid, implicit barrier */
+
+			if (out_steps[t])
+				k++;
+		}  /* for loop on time */
 
+		if (first_touch) {
+#pragma omp for schedule(runtime)
+			for (n = 0; n < N; n++)
+				_copy_state(s, n, state, n);
+		}
+
+		_flush_counters();
+	}
+
+	omp_set_schedule(old_kind, old_chunk);
+
+	if (first_touch)
+		_free_state(&work);
+	free(agg_before);
+	free(agg_count);
+
+	return -1;
 }
@@ -0,0 +1,321 @@
+/*
+ ** NAME
+ **      e_bal_block -- energy balance for a block of pixels in lockstep
+ **
+ ** SYNOPSIS
+ **      #include "pointsnobal.h"
+ **
+ **      int
+ **	e_bal_block(int N, double time_step, PARAMS params,
+ **		    EBAL_REC_ARR* eb)
+ **
+ **      int
+ **	e_bal_scalar(int N, double time_step, PARAMS params,
+ **		     EBAL_REC_ARR* eb)
+ **
+ ** DESCRIPTION
+ **      e_bal_block evaluates the same energy balance as _e_bal
+ **	(_net_rad, _h_le/hle1, g_soil/g_snow and _advec) for N pixels held
+ **	as struct of arrays, so the compiler can vectorize across pixels.
+ **	The physics is the inline code of _e_bal.h that the scalar
+ **	library functions use too. The Obukhov length iteration of hle1
+ **	runs for all pixels of a block together, with a mask so converged
+ **	pixels stop updating. hle1 starts from neutral stability.
+ **
+ **	Bad inputs and non-convergence are flagged in eb->status instead
+ **	of printing a message or exiting. g_soil's warning for a snow
+ **	temperature above freezing is not printed, the temperature is
+ **	still limited to freezing.
+ **
+ **	e_bal_scalar runs _e_bal one pixel at a time through the snobal
+ **	globals, as a reference for e_bal_block.
+ **
+ ** RETURN VALUE
+ **
+ **	TRUE	The energy balance was computed for every pixel.
+ **
+ **	FALSE	At least one pixel had bad inputs or hle1 did not
+ **		converge, see eb->status.
+ */
+
+#include <math.h>
+
+#include "_snobal.h"
+#include "_e_bal.h"
+#include "pointsnobal.h"
+
+#define BLOCK		256	/* pixels evaluated together		*/
+
+/*
+ * Energy balance for pixels [start, start + nb) of eb, nb <= BLOCK
+ */
+static int
+_e_bal_block(
+		int	start,
+		int	nb,
+		double	time_step,
+		PARAMS	params,
+		EBAL_REC_ARR* eb)
+{
+	/* per pixel hle1 state */
+	double	pta[BLOCK];	/* potential air temperature (K)	*/
+	double	za[BLOCK];	/* also the humidity height		*/
+	double	zu[BLOCK];
+	double	ltsm[BLOCK];
+	double	ltsh[BLOCK];
+	double	ltsv[BLOCK];
+	double	qa[BLOCK];
+	double	qs[BLOCK];
+	double	dens[BLOCK];
+	double	ustar[BLOCK];
+	double	lo[BLOCK];
+	double	h[BLOCK];
+	double	e[BLOCK];
+	int	active[BLOCK];
+	int	iter[BLOCK];
+	int	ok[BLOCK];
+
+	int	all_ok = TRUE;
+	int	any;
+	int	it;
+	int	i;
+
+	/*
+	 * net radiation, measurement heights and the hle1 starting values
+	 * at neutral stability
+	 */
+#pragma omp simd reduction(&:all_ok)
+	for (i = 0; i < nb; i++) {
+		int	n = start + i;
+		double	ts = eb->T_s_0[n];
+		double	e_s;
+
+		active[i] = 0;
+		iter[i] = 0;
+		ok[i] = 1;
+		lo[i] = HUGE_VAL;
+
+		if (eb->layer_count[n] == 0)
+			continue;
+
+		eb->R_n[n] = eb_net_rad(eb->S_n[n], eb->I_lw[n], ts);
+
+		/* temperatures are Kelvin, sati exits otherwise */
+		if (eb->T_a[n] <= 0 || ts <= 0 || eb->T_g[n] <= 0 ||
+				(eb->layer_count[n] == 2 && eb->T_s_l[n] <= 0)) {
+			ok[i] = 0;
+			all_ok &= 0;
+			continue;
+		}
+
+		/* _h_le */
+		e_s = eb_sati(ts);
+		eb->e_a[n] = fmin(eb->e_a[n], eb_sati(eb->T_a[n]));
+
+		if (params.relative_heights) {
+			za[i] = params.z_T;
+			zu[i] = params.z_u;
+		} else {
+			za[i] = params.z_T - eb->z_s[n];
+			zu[i] = params.z_u - eb->z_s[n];
+		}
+
+		/* hle1 */
+		if (eb_hle1_check(eb->P_a[n], eb->T_a[n], ts, za[i],
+				eb->e_a[n], e_s, za[i], zu[i], eb->z_0[n])
+				!= HLE1_OK) {
+			ok[i] = 0;
+			all_ok &= 0;
+			continue;
+		}
+
+		eb_hle1_setup(eb->P_a[n], eb->T_a[n], ts, za[i], eb->e_a[n],
+				e_s, za[i], zu[i], eb->z_0[n], &ltsm[i],
+				&ltsh[i], &ltsv[i], &qa[i], &qs[i], &pta[i],
+				&dens[i]);
+
+		eb_hle1_fluxes(lo[i], eb->u[n], zu[i], za[i], za[i], ltsm[i],
+				ltsh[i], ltsv[i], qa[i], qs[i], pta[i], ts,
+				dens[i], &ustar[i], &h[i], &e[i]);
+
+		active[i] = (pta[i] != ts);
+	}
+
+	/*
+	 * iterate on Obukhov stability length for all pixels together,
+	 * pixels drop out once converged
+	 */
+	for (it = 0; it < ITMAX; it++) {
+		any = 0;
+#pragma omp simd reduction(|:any)
+		for (i = 0; i < nb; i++) {
+			double	last;
+
+			if (! active[i])
+				continue;
+
+			last = lo[i];
+			lo[i] = eb_hle1_lo(ustar[i], dens[i], h[i], e[i], pta[i]);
+
+			eb_hle1_fluxes(lo[i], eb->u[start + i], zu[i], za[i],
+					za[i], ltsm[i], ltsh[i], ltsv[i], qa[i],
+					qs[i], pta[i], eb->T_s_0[start + i],
+					dens[i], &ustar[i], &h[i], &e[i]);
+
+			if (eb_hle1_converged(last, lo[i]) ||
+					++iter[i] >= ITMAX)
+				active[i] = 0;
+
+			any |= active[i];
+		}
+		if (! any)
+			break;
+	}
+
+	/*
+	 * turbulent fluxes, conduction, advection and the energy budget
+	 */
+#pragma omp simd reduction(&:all_ok)
+	for (i = 0; i < nb; i++) {
+		int	n = start + i;
+		double	ts = eb->T_s_0[n];
+		double	tsno;
+
+		if (eb->layer_count[n] == 0) {
+			eb->R_n[n] = 0.0;
+			eb->H[n] = eb->L_v_E[n] = eb->E[n] = 0.0;
+			eb->G[n] = eb->G_0[n] = 0.0;
+			eb->M[n] = 0.0;
+			eb->delta_Q[n] = eb->delta_Q_0[n] = 0.0;
+			eb->status[n] = TRUE;
+			continue;
+		}
+
+		if (! ok[i] || iter[i] >= ITMAX) {
+			eb->status[n] = FALSE;
+			all_ok &= 0;
+			continue;
+		}
+		eb->status[n] = TRUE;
+
+		eb->H[n] = h[i];
+		eb->E[n] = e[i];
+		eb->L_v_E[n] = eb_xlh(ts) * e[i];
+
+		/* g_soil with the lower layer, or the only layer */
+		if (eb->layer_count[n] == 1) {
+			tsno = fmin(ts, FREEZE);
+			eb->G[n] = eb_g_soil(eb->rho[n], tsno, eb->T_g[n],
+					eb->z_s_0[n], params.z_g, eb->P_a[n],
+					eb_sati(eb->T_g[n]), eb_sati(tsno));
+			eb->G_0[n] = eb->G[n];
+		}
+		else {
+			tsno = fmin(eb->T_s_l[n], FREEZE);
+			eb->G[n] = eb_g_soil(eb->rho[n], tsno, eb->T_g[n],
+					eb->z_s_l[n], params.z_g, eb->P_a[n],
+					eb_sati(eb->T_g[n]), eb_sati(tsno));
+			eb->G_0[n] = (ts == eb->T_s_l[n])? 0.0 :
+				eb_g_snow(eb->rho[n], eb->rho[n], ts,
+					eb->T_s_l[n], eb->z_s_0[n],
+					eb->z_s_l[n], eb->P_a[n],
+					eb_sati(ts), eb_sati(eb->T_s_l[n]));
+		}
+
+		eb->M[n] = eb_advec(eb->precip_now[n], eb->m_rain[n],
+				eb->T_rain[n], eb->m_snow[n], eb->T_snow[n],
+				ts, time_step);
+
+		/* surface and total snowpack energy budget */
+		eb->delta_Q_0[n] = eb->R_n[n] + eb->H[n] + eb->L_v_E[n] +
+				eb->G_0[n] + eb->M[n];
+		if (eb->layer_count[n] == 1)
+			eb->delta_Q[n] = eb->delta_Q_0[n];
+		else
+			eb->delta_Q[n] = eb->delta_Q_0[n] + eb->G[n] - eb->G_0[n];
+	}
+
+	return all_ok;
+}
+
+int
+e_bal_block(
+		int	N,
+		double	time_step,
+		PARAMS	params,
+		EBAL_REC_ARR* eb)
+{
+	int	start;
+	int	all_ok = TRUE;
+
+	for (start = 0; start < N; start += BLOCK) {
+		if (! _e_bal_block(start, (N - start < BLOCK)? N - start : BLOCK,
+				time_step, params, eb))
+			all_ok = FALSE;
+	}
+
+	return all_ok;
+}
+
+/* ----------------------------------------------------------------------- */
+
+int
+e_bal_scalar(
+		int	N,
+		double	time_step_in,
+		PARAMS	params,
+		EBAL_REC_ARR* eb)
+{
+	int	n;
+	int	all_ok = TRUE;
+
+	z_u = params.z_u;
+	z_T = params.z_T;
+	z_g = params.z_g;
+	relative_hts = params.relative_heights;
+	time_step = time_step_in;
+
+	/* no previous Obukhov length, hle1 starts from neutral stability */
+	warm_start = FALSE;
+
+	for (n = 0; n < N; n++) {
+		layer_count = eb->layer_count[n];
+		snowcover = (layer_count > 0);
+		precip_now = eb->precip_now[n];
+		S_n = eb->S_n[n];
+		I_lw = eb->I_lw[n];
+		T_a = eb->T_a[n];
+		e_a = eb->e_a[n];
+		u = eb->u[n];
+		T_g = eb->T_g[n];
+		P_a = eb->P_a[n];
+		z_0 = eb->z_0[n];
+		z_s = eb->z_s[n];
+		z_s_0 = eb->z_s_0[n];
+		z_s_l = eb->z_s_l[n];
+		rho = eb->rho[n];
+		T_s_0 = eb->T_s_0[n];
+		T_s_l = eb->T_s_l[n];
+		m_rain = eb->m_rain[n];
+		m_snow = eb->m_snow[n];
+		T_rain = eb->T_rain[n];
+		T_snow = eb->T_snow[n];
+
+		eb->status[n] = _e_bal();
+		if (! eb->status[n])
+			all_ok = FALSE;
+
+		eb->e_a[n] = e_a;
+		eb->R_n[n] = R_n;
+		eb->H[n] = H;
+		eb->L_v_E[n] = L_v_E;
+		eb->E[n] = E;
+		eb->G[n] = G;
+		eb->G_0[n] = G_0;
+		eb->M[n] = M;
+		eb->delta_Q[n] = delta_Q;
+		eb->delta_Q_0[n] = delta_Q_0;
+	}
+
+	return all_ok;
+}
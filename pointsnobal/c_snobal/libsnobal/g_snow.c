@@ -1,5 +1,6 @@
 //#include "ipw.h"
 #include "snow.h"
+#include "_e_bal.h"
 
 double
 g_snow(
@@ -11,26 +12,15 @@ g_snow(
 	double	ds2,	/* lower  "     "         "     (m)	*/
 	double	pa)	/* air pressure (Pa)			*/
 {
-	double	kcs1;
-	double	kcs2;
-	double	k_s1;
-	double	k_s2;
 	double	g;
 
 
 /*	calculate G	*/
 	if (ts1 == ts2)
 		g = 0.0;
-	else {
-	/*	set snow conductivity	*/
-		kcs1 = KTS(rho1);
-		kcs2 = KTS(rho2);
-		k_s1 = efcon(kcs1, ts1, pa);
-		k_s2 = efcon(kcs2, ts2, pa);
-
-	/*	calculate g	*/
-		g = ssxfr(k_s1, k_s2, ts1, ts2, ds1, ds2);
-	}
+	else
+		g = eb_g_snow(rho1, rho2, ts1, ts2, ds1, ds2, pa,
+				sati(ts1), sati(ts2));
 
 	return (g);
 }
@@ -1,5 +1,6 @@
 //#include "ipw.h"
 #include "snow.h"
+#include "_e_bal.h"
 
 double
 g_soil(
@@ -10,11 +11,6 @@ g_soil(
 		double	dg,	/* dpeth of soil temperature measurement (m) */
 		double	pa)	/* air pressure (Pa)			     */
 {
-	double	k_g;
-	double	kcs;
-	double	k_s;
-	double	g;
-
 	/*	check tsno	*/
 	if (tsno > FREEZE) {
 //		warn("g_soil: tsno = %8.2f; set to %8.2f\n", tsno, FREEZE);
@@ -22,19 +18,5 @@ g_soil(
 		tsno = FREEZE;
 	}
 
-	/*	set effective soil conductivity	*/
-	/***	changed to KT_MOISTSAND by D. Marks, NWRC, 09/30/2003	***/
-	/***	based on heat flux data from RMSP			***/
-	/***	note: Kt should be passed as an argument		***/
-	/***	k_g = efcon(KT_WETSAND, tg, pa);			***/
-	k_g = efcon(KT_MOISTSAND, tg, pa);
-
-	/*	calculate G	*/
-	/*	set snow conductivity	*/
-	kcs = KTS(rho);
-	k_s = efcon(kcs, tsno, pa);
-
-	g = ssxfr(k_s, k_g, tsno, tg, ds, dg);
-
-	return (g);
+	return eb_g_soil(rho, tsno, tg, ds, dg, pa, sati(tg), sati(tsno));
 }
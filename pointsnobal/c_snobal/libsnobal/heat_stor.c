@@ -1,5 +1,6 @@
 //#include "ipw.h"
 #include "envphys.h"
+#include "_e_bal.h"
 
 double
 heat_stor(
@@ -7,9 +8,5 @@ heat_stor(
 	double	spm,	/* layer specific mass (kg/m^2)    */
 	double	tdif)	/* temperature change (K)          */
 {
-	double	stor;
-
-	stor = cp * spm * tdif;
-
-	return (stor);
+	return eb_heat_stor(cp, spm, tdif);
 }
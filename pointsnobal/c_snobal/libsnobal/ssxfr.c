@@ -1,5 +1,6 @@
 //#include "ipw.h"
 #include "envphys.h"
+#include "_e_bal.h"
 
 double
 ssxfr(
@@ -10,9 +11,5 @@ ssxfr(
 	double	d1,     /* layer 1's thickness (m)			   */
 	double	d2)     /* layer 2's    "       "			   */
 {
-	double	xfr;
-
-	xfr = 2.0 * (k1 * k2 * (t2 - t1)) / ((k2 * d1) + (k1 * d2));
-
-	return (xfr);
+	return eb_ssxfr(k1, k2, t1, t2, d1, d2);
 }
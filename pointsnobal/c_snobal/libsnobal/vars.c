@@ -158,6 +158,14 @@
 	double  delta_Q;        /* change in snowcover's energy (W/m^2) */
 	double  delta_Q_0;      /* change in active layer's energy (W/m^2) */
 
+/*   turbulent transfer iteration (hle1)   */
+
+	int	warm_start;	/* start hle1 from the last Obukhov length? */
+	double	obukhov_lo;	/* last converged Obukhov length (m),
+				   HUGE_VAL if neutral or unknown */
+	long	hle1_calls;	/* # of hle1 calls in this thread */
+	long	hle1_iters;	/* # of hle1 iterations in this thread */
+
 /*   averages of energy balance vars since last output record   */
 
 	double	R_n_bar;
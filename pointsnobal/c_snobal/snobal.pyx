@@ -132,6 +132,10 @@ cdef extern from "envphys.h":
 cdef extern from "pointsnobal.h":
     #cdef int call_snobal(int N, int nthreads, int first_step, TSTEP_REC tstep_info[4], OUTPUT_REC** output_rec, INPUT_REC_ARR* input1, INPUT_REC_ARR* input2, PARAMS params, OUTPUT_REC_ARR* output1);
     cdef int call_snobal(int N, int nthreads, int first_step, TSTEP_REC tstep_info[4], INPUT_REC_ARR* input1, INPUT_REC_ARR* input2, PARAMS params, OUTPUT_REC_ARR* output1);
+    cdef int e_bal_block(int N, double time_step, PARAMS params, EBAL_REC_ARR* eb);
+    cdef int e_bal_scalar(int N, double time_step, PARAMS params, EBAL_REC_ARR* eb);
+    cdef void hle1_counters(long *calls, long *iters, int reset);
+    cdef int call_snobal_grid(int N, int T, int nthreads, int schedule, int chunk, int first_touch, TSTEP_REC tstep_info[4], INPUT_REC_ARR* inputs, PARAMS params, OUTPUT_REC_ARR* state, int* out_steps, OUTPUT_REC_ARR* outputs, int n_aggs, AGGREGATOR* aggs);
 
     ctypedef struct OUTPUT_REC:
         int masked;
@@ -169,6 +173,7 @@ cdef extern from "pointsnobal.h":
         double E_s_sum;
         double melt_sum;
         double ro_pred_sum;
+        double obukhov_lo;
 
     ctypedef struct OUTPUT_REC_ARR:
         int* masked;
@@ -206,6 +211,7 @@ cdef extern from "pointsnobal.h":
         double* E_s_sum;
         double* melt_sum;
         double* ro_pred_sum;
+        double* obukhov_lo;
 
     ctypedef struct INPUT_REC_ARR:
         double* S_n;
@@ -219,6 +225,38 @@ cdef extern from "pointsnobal.h":
         double* rho_snow;
         double* T_pp;
 
+    ctypedef struct EBAL_REC_ARR:
+        int* layer_count;
+        int* precip_now;
+        double* S_n;
+        double* I_lw;
+        double* T_a;
+        double* e_a;
+        double* u;
+        double* T_g;
+        double* P_a;
+        double* z_0;
+        double* z_s;
+        double* z_s_0;
+        double* z_s_l;
+        double* rho;
+        double* T_s_0;
+        double* T_s_l;
+        double* m_rain;
+        double* m_snow;
+        double* T_rain;
+        double* T_snow;
+        double* R_n;
+        double* H;
+        double* L_v_E;
+        double* E;
+        double* G;
+        double* G_0;
+        double* M;
+        double* delta_Q;
+        double* delta_Q_0;
+        int* status;
+
     ctypedef struct PARAMS:
         double z_u;
         double z_T;
@@ -226,6 +264,13 @@ cdef extern from "pointsnobal.h":
         int relative_heights;
         double max_h2o_vol;
         double max_z_s_0;
+        int warm_start;
+
+    ctypedef struct AGGREGATOR:
+        int var;
+        int stat;
+        int period;
+        double* out;
 
 
 
@@ -255,6 +300,7 @@ def do_tstep_grid(input1, input2, output_rec, tstep_rec, mh, params, int first_s
     c_params.relative_heights = int(params['relative_heights'])
     c_params.max_h2o_vol = params['max_h2o_vol']
     c_params.max_z_s_0 = params['max_z_s_0']
+    c_params.warm_start = int(params.get('warm_start', True))
 #
 
 
@@ -417,6 +463,14 @@ def do_tstep_grid(input1, input2, output_rec, tstep_rec, mh, params, int first_s
     output1_ro_pred_sum = np.ascontiguousarray(output_rec['ro_pred_sum'], dtype=np.float64)
     output1_c.ro_pred_sum = &output1_ro_pred_sum[0,0]
 
+    cdef np.ndarray[double, mode="c", ndim=2] output1_obukhov_lo
+    # states from before the Obukhov length was kept start from neutral
+    if 'obukhov_lo' in output_rec:
+        output1_obukhov_lo = np.ascontiguousarray(output_rec['obukhov_lo'], dtype=np.float64)
+    else:
+        output1_obukhov_lo = np.full(np.shape(output_rec['ro_pred_sum']), np.inf)
+    output1_c.obukhov_lo = &output1_obukhov_lo[0,0]
+
     # end1 = clock()
     # cpu_time_used1 = (<double> (end1 - start1)) / CLOCKS_PER_SEC
     # print('time 1 {}'.format(cpu_time_used1))
@@ -569,6 +623,8 @@ def do_tstep_grid(input1, input2, output_rec, tstep_rec, mh, params, int first_s
     output_rec['E_s_sum'][:] = np.PyArray_SimpleNewFromData(2, shp_np, np.NPY_FLOAT64, output1_c.E_s_sum)
     output_rec['melt_sum'][:] = np.PyArray_SimpleNewFromData(2, shp_np, np.NPY_FLOAT64, output1_c.melt_sum)
     output_rec['ro_pred_sum'][:] = np.PyArray_SimpleNewFromData(2, shp_np, np.NPY_FLOAT64, output1_c.ro_pred_sum)
+    if 'obukhov_lo' in output_rec:
+        output_rec['obukhov_lo'][:] = np.PyArray_SimpleNewFromData(2, shp_np, np.NPY_FLOAT64, output1_c.obukhov_lo)
 
     # end3 = clock()
     # cpu_time_used3 = (<double> (end3 - start3)) / CLOCKS_PER_SEC
@@ -579,6 +635,341 @@ def do_tstep_grid(input1, input2, output_rec, tstep_rec, mh, params, int first_s
 
 
 
+# OpenMP loop schedules for do_tstep_series, values of omp_sched_t
+SCHEDULES = {'static': 1, 'dynamic': 2, 'guided': 3, 'auto': 4}
+
+# Model state keys that are integers, the rest are doubles
+INT_STATE_KEYS = ['mask', 'layer_count']
+
+# Quantities do_tstep_series can aggregate, in the order of the AGG_*
+# values in pointsnobal.h. State variables are taken at the end of each
+# data timestep, fluxes (W/m^2) are the mean over the data timestep and
+# mass totals (kg/m^2) the sum.
+AGG_VARIABLES = [
+    'T_s_0', 'T_s_l', 'T_s', 'z_s', 'rho', 'm_s', 'h2o', 'h2o_sat', 'cc_s',
+    'R_n', 'H', 'L_v_E', 'G', 'M', 'delta_Q', 'G_0', 'delta_Q_0',
+    'E_s', 'melt', 'ro_predict'
+]
+
+# Aggregation statistics, values of AGG_MEAN etc.
+AGG_STATS = {'mean': 0, 'min': 1, 'max': 2, 'sum': 3}
+
+
+cdef dict _state_arrays(dict state, OUTPUT_REC_ARR* c_state):
+    """
+    Point c_state at C contiguous copies (or views) of the state arrays.
+    The returned dictionary keeps the arrays alive.
+    """
+    arrays = {}
+    for key, value in state.items():
+        dtype = np.int32 if key in INT_STATE_KEYS else np.float64
+        arrays[key] = np.ascontiguousarray(value, dtype=dtype)
+    # states from before the Obukhov length was kept start from neutral
+    if 'obukhov_lo' not in arrays:
+        arrays['obukhov_lo'] = np.full(arrays['m_s'].shape, np.inf)
+
+    c_state.masked = <int*> np.PyArray_DATA(arrays['mask'])
+    c_state.current_time = <double*> np.PyArray_DATA(arrays['current_time'])
+    c_state.time_since_out = <double*> np.PyArray_DATA(arrays['time_since_out'])
+    c_state.elevation = <double*> np.PyArray_DATA(arrays['elevation'])
+    c_state.z_0 = <double*> np.PyArray_DATA(arrays['z_0'])
+    c_state.rho = <double*> np.PyArray_DATA(arrays['rho'])
+    c_state.T_s_0 = <double*> np.PyArray_DATA(arrays['T_s_0'])
+    c_state.T_s_l = <double*> np.PyArray_DATA(arrays['T_s_l'])
+    c_state.T_s = <double*> np.PyArray_DATA(arrays['T_s'])
+    c_state.h2o_sat = <double*> np.PyArray_DATA(arrays['h2o_sat'])
+    c_state.h2o_max = <double*> np.PyArray_DATA(arrays['h2o_max'])
+    c_state.h2o = <double*> np.PyArray_DATA(arrays['h2o'])
+    c_state.h2o_vol = <double*> np.PyArray_DATA(arrays['h2o_vol'])
+    c_state.h2o_total = <double*> np.PyArray_DATA(arrays['h2o_total'])
+    c_state.layer_count = <int*> np.PyArray_DATA(arrays['layer_count'])
+    c_state.cc_s_0 = <double*> np.PyArray_DATA(arrays['cc_s_0'])
+    c_state.cc_s_l = <double*> np.PyArray_DATA(arrays['cc_s_l'])
+    c_state.cc_s = <double*> np.PyArray_DATA(arrays['cc_s'])
+    c_state.m_s_0 = <double*> np.PyArray_DATA(arrays['m_s_0'])
+    c_state.m_s_l = <double*> np.PyArray_DATA(arrays['m_s_l'])
+    c_state.m_s = <double*> np.PyArray_DATA(arrays['m_s'])
+    c_state.z_s_0 = <double*> np.PyArray_DATA(arrays['z_s_0'])
+    c_state.z_s_l = <double*> np.PyArray_DATA(arrays['z_s_l'])
+    c_state.z_s = <double*> np.PyArray_DATA(arrays['z_s'])
+    c_state.R_n_bar = <double*> np.PyArray_DATA(arrays['R_n_bar'])
+    c_state.H_bar = <double*> np.PyArray_DATA(arrays['H_bar'])
+    c_state.L_v_E_bar = <double*> np.PyArray_DATA(arrays['L_v_E_bar'])
+    c_state.G_bar = <double*> np.PyArray_DATA(arrays['G_bar'])
+    c_state.G_0_bar = <double*> np.PyArray_DATA(arrays['G_0_bar'])
+    c_state.M_bar = <double*> np.PyArray_DATA(arrays['M_bar'])
+    c_state.delta_Q_bar = <double*> np.PyArray_DATA(arrays['delta_Q_bar'])
+    c_state.delta_Q_0_bar = <double*> np.PyArray_DATA(arrays['delta_Q_0_bar'])
+    c_state.E_s_sum = <double*> np.PyArray_DATA(arrays['E_s_sum'])
+    c_state.melt_sum = <double*> np.PyArray_DATA(arrays['melt_sum'])
+    c_state.ro_pred_sum = <double*> np.PyArray_DATA(arrays['ro_pred_sum'])
+    c_state.obukhov_lo = <double*> np.PyArray_DATA(arrays['obukhov_lo'])
+
+    return arrays
+
+
+cdef dict _input_arrays(dict inputs, INPUT_REC_ARR* c_inputs):
+    """
+    Point c_inputs at C contiguous copies (or views) of the input arrays.
+    The returned dictionary keeps the arrays alive.
+    """
+    arrays = {
+        key: np.ascontiguousarray(value, dtype=np.float64)
+        for key, value in inputs.items()
+    }
+
+    c_inputs.S_n = <double*> np.PyArray_DATA(arrays['S_n'])
+    c_inputs.I_lw = <double*> np.PyArray_DATA(arrays['I_lw'])
+    c_inputs.T_a = <double*> np.PyArray_DATA(arrays['T_a'])
+    c_inputs.e_a = <double*> np.PyArray_DATA(arrays['e_a'])
+    c_inputs.u = <double*> np.PyArray_DATA(arrays['u'])
+    c_inputs.T_g = <double*> np.PyArray_DATA(arrays['T_g'])
+    c_inputs.m_pp = <double*> np.PyArray_DATA(arrays['m_pp'])
+    c_inputs.percent_snow = <double*> np.PyArray_DATA(arrays['percent_snow'])
+    c_inputs.rho_snow = <double*> np.PyArray_DATA(arrays['rho_snow'])
+    c_inputs.T_pp = <double*> np.PyArray_DATA(arrays['T_pp'])
+
+    return arrays
+
+
+def do_tstep_series(inputs, output_rec, tstep_rec, mh, params, out_steps,
+                    output_series, int nthreads=1, schedule='static',
+                    int chunk=0, first_touch=True, aggregators=None):
+    """
+    Run every data timestep of an input series in one call, keeping a
+    single OpenMP parallel region open for the whole time loop
+
+    Args:
+        inputs: dictionary of [T, N] input arrays, one row per timestep
+        output_rec: model state, dictionary of arrays with N values that
+            is updated in place
+        tstep_rec: timestep info from initialize_model
+        mh: measurement heights
+        params: model parameters
+        out_steps: length T boolean array of the timesteps to output
+        output_series: dictionary with the same keys as output_rec of
+            [n_out, N] arrays that the state is copied into at each output
+        nthreads: number of threads
+        schedule: OpenMP schedule over pixels, one of SCHEDULES
+        chunk: chunk size for the schedule, 0 for the OpenMP default
+        first_touch: allocate the state per thread on first touch (NUMA),
+            only useful with the static schedule
+        aggregators: list of (variable, stat, period, out) updated after
+            every data timestep. variable is one of AGG_VARIABLES, stat
+            one of AGG_STATS, period the number of data timesteps per
+            aggregate and out a [ceil((T - 1) / period), N] array
+
+    Returns:
+        -1 on success
+    """
+    cdef int N = output_rec['elevation'].size
+    cdef int T = len(out_steps)
+
+    if schedule not in SCHEDULES:
+        raise ValueError(f'{schedule} is not one of {list(SCHEDULES)}')
+    if T < 2:
+        raise ValueError('At least two timesteps are needed')
+    if nthreads < 1:
+        raise ValueError('nthreads must be at least 1')
+
+    # the C loop does not know the array sizes, check them here
+    # the first timestep only provides the starting inputs
+    cdef int n_out = int(np.count_nonzero(out_steps[1:]))
+    for key, value in output_rec.items():
+        if np.size(value) != N:
+            raise ValueError(f'State {key} does not have {N} values')
+    for key, value in inputs.items():
+        if np.size(value) != T * N:
+            raise ValueError(f'Input {key} is not [{T}, {N}]')
+    for key, value in output_series.items():
+        if np.size(value) != n_out * N:
+            raise ValueError(f'Output {key} is not [{n_out}, {N}]')
+
+    # measurement heights and parameters
+    cdef PARAMS c_params
+    c_params.z_u = mh['z_u']
+    c_params.z_T = mh['z_t']
+    c_params.z_g = mh['z_g']
+    c_params.relative_heights = int(params['relative_heights'])
+    c_params.max_h2o_vol = params['max_h2o_vol']
+    c_params.max_z_s_0 = params['max_z_s_0']
+    c_params.warm_start = int(params.get('warm_start', True))
+
+    for i in range(len(tstep_rec)):
+        tstep_info[i].level = int(tstep_rec[i]['level'])
+        if tstep_rec[i]['time_step'] is not None:
+            tstep_info[i].time_step = tstep_rec[i]['time_step']
+        if tstep_rec[i]['intervals'] is not None:
+            tstep_info[i].intervals = int(tstep_rec[i]['intervals'])
+        if tstep_rec[i]['threshold'] is not None:
+            tstep_info[i].threshold = tstep_rec[i]['threshold']
+        tstep_info[i].output = int(tstep_rec[i]['output'])
+
+    cdef INPUT_REC_ARR inputs_c
+    cdef OUTPUT_REC_ARR state_c
+    cdef OUTPUT_REC_ARR outputs_c
+    input_arrays = _input_arrays(inputs, &inputs_c)
+    state_arrays = _state_arrays(output_rec, &state_c)
+    series_arrays = _state_arrays(output_series, &outputs_c)
+
+    cdef np.ndarray[int, mode="c", ndim=1] out_steps_c
+    out_steps_c = np.ascontiguousarray(out_steps, dtype=np.int32)
+
+    # aggregators, the arrays list keeps the outputs alive
+    aggregators = aggregators or []
+    cdef int n_aggs = len(aggregators)
+    cdef AGGREGATOR* aggs_c = NULL
+    agg_arrays = []
+    for variable, stat, period, out in aggregators:
+        if variable not in AGG_VARIABLES:
+            raise ValueError(f'{variable} is not one of {AGG_VARIABLES}')
+        if stat not in AGG_STATS:
+            raise ValueError(f'{stat} is not one of {list(AGG_STATS)}')
+        if period < 1:
+            raise ValueError('The aggregation period must be at least 1')
+        if out.size != -(-(T - 1) // period) * N:
+            raise ValueError(f'Output for {variable} {stat} is the wrong size')
+        agg_arrays.append(np.ascontiguousarray(out, dtype=np.float64))
+
+    if n_aggs > 0:
+        aggs_c = <AGGREGATOR*> malloc(n_aggs * sizeof(AGGREGATOR))
+        if aggs_c == NULL:
+            raise MemoryError('Could not allocate the aggregators')
+        for i, (variable, stat, period, out) in enumerate(aggregators):
+            aggs_c[i].var = AGG_VARIABLES.index(variable)
+            aggs_c[i].stat = AGG_STATS[stat]
+            aggs_c[i].period = period
+            aggs_c[i].out = <double*> np.PyArray_DATA(agg_arrays[i])
+
+    rt = call_snobal_grid(
+        N, T, nthreads, SCHEDULES[schedule], chunk, int(first_touch),
+        tstep_info, &inputs_c, c_params, &state_c, &out_steps_c[0],
+        &outputs_c, n_aggs, aggs_c)
+    free(aggs_c)
+    if rt == 0:
+        raise MemoryError('Could not allocate the model state')
+
+    # copy back in case the state or outputs were not already contiguous
+    for key, value in output_rec.items():
+        value[:] = state_arrays[key].reshape(value.shape)
+    for key, value in output_series.items():
+        value[:] = series_arrays[key].reshape(value.shape)
+    for (_, _, _, out), value in zip(aggregators, agg_arrays):
+        out[:] = value.reshape(out.shape)
+
+    return rt
+
+
+
+
+def get_hle1_counters(reset=False):
+    """
+    Total hle1 calls and Obukhov length iterations made by the model
+
+    Args:
+        reset: set the totals back to zero after reading them
+
+    Returns:
+        dictionary of `calls` and `iterations`
+    """
+    cdef long calls, iters
+    hle1_counters(&calls, &iters, int(reset))
+    return {'calls': calls, 'iterations': iters}
+
+
+# Inputs and outputs of e_bal
+E_BAL_INT_INPUTS = ['layer_count', 'precip_now']
+E_BAL_INPUTS = [
+    'S_n', 'I_lw', 'T_a', 'e_a', 'u', 'T_g', 'P_a', 'z_0', 'z_s', 'z_s_0',
+    'z_s_l', 'rho', 'T_s_0', 'T_s_l', 'm_rain', 'm_snow', 'T_rain', 'T_snow'
+]
+E_BAL_OUTPUTS = [
+    'R_n', 'H', 'L_v_E', 'E', 'G', 'G_0', 'M', 'delta_Q', 'delta_Q_0'
+]
+
+
+def e_bal(inputs, mh, double time_step, vectorized=True):
+    """
+    Energy balance for a set of pixels at one run timestep, the same
+    terms as _e_bal computes for the current pixel inside snobal
+
+    Args:
+        inputs: dictionary of 1D arrays, keys from E_BAL_INT_INPUTS and
+            E_BAL_INPUTS with temperatures in K
+        mh: measurement heights and relative_heights
+        time_step: length of the run timestep (sec), used for advection
+        vectorized: use the batched e_bal_block kernel, otherwise run
+            _e_bal one pixel at a time
+
+    Returns:
+        dictionary of E_BAL_OUTPUTS arrays, the vapor pressure `e_a`
+        limited to saturation, and `status` which is False where the
+        energy balance could not be computed
+    """
+    cdef int N = len(inputs['T_a'])
+    cdef PARAMS c_params
+    c_params.z_u = mh['z_u']
+    c_params.z_T = mh['z_t']
+    c_params.z_g = mh['z_g']
+    c_params.relative_heights = int(mh['relative_heights'])
+
+    arrays = {}
+    for key in E_BAL_INT_INPUTS:
+        arrays[key] = np.array(inputs[key], dtype=np.int32, order='C')
+    for key in E_BAL_INPUTS:
+        arrays[key] = np.array(inputs[key], dtype=np.float64, order='C')
+    for key in E_BAL_OUTPUTS:
+        arrays[key] = np.zeros(N, dtype=np.float64)
+    arrays['status'] = np.zeros(N, dtype=np.int32)
+    for key, value in arrays.items():
+        if value.shape != (N,):
+            raise ValueError(f'{key} must be a 1D array of length {N}')
+
+    cdef EBAL_REC_ARR eb
+    eb.layer_count = <int*> np.PyArray_DATA(arrays['layer_count'])
+    eb.precip_now = <int*> np.PyArray_DATA(arrays['precip_now'])
+    eb.S_n = <double*> np.PyArray_DATA(arrays['S_n'])
+    eb.I_lw = <double*> np.PyArray_DATA(arrays['I_lw'])
+    eb.T_a = <double*> np.PyArray_DATA(arrays['T_a'])
+    eb.e_a = <double*> np.PyArray_DATA(arrays['e_a'])
+    eb.u = <double*> np.PyArray_DATA(arrays['u'])
+    eb.T_g = <double*> np.PyArray_DATA(arrays['T_g'])
+    eb.P_a = <double*> np.PyArray_DATA(arrays['P_a'])
+    eb.z_0 = <double*> np.PyArray_DATA(arrays['z_0'])
+    eb.z_s = <double*> np.PyArray_DATA(arrays['z_s'])
+    eb.z_s_0 = <double*> np.PyArray_DATA(arrays['z_s_0'])
+    eb.z_s_l = <double*> np.PyArray_DATA(arrays['z_s_l'])
+    eb.rho = <double*> np.PyArray_DATA(arrays['rho'])
+    eb.T_s_0 = <double*> np.PyArray_DATA(arrays['T_s_0'])
+    eb.T_s_l = <double*> np.PyArray_DATA(arrays['T_s_l'])
+    eb.m_rain = <double*> np.PyArray_DATA(arrays['m_rain'])
+    eb.m_snow = <double*> np.PyArray_DATA(arrays['m_snow'])
+    eb.T_rain = <double*> np.PyArray_DATA(arrays['T_rain'])
+    eb.T_snow = <double*> np.PyArray_DATA(arrays['T_snow'])
+    eb.R_n = <double*> np.PyArray_DATA(arrays['R_n'])
+    eb.H = <double*> np.PyArray_DATA(arrays['H'])
+    eb.L_v_E = <double*> np.PyArray_DATA(arrays['L_v_E'])
+    eb.E = <double*> np.PyArray_DATA(arrays['E'])
+    eb.G = <double*> np.PyArray_DATA(arrays['G'])
+    eb.G_0 = <double*> np.PyArray_DATA(arrays['G_0'])
+    eb.M = <double*> np.PyArray_DATA(arrays['M'])
+    eb.delta_Q = <double*> np.PyArray_DATA(arrays['delta_Q'])
+    eb.delta_Q_0 = <double*> np.PyArray_DATA(arrays['delta_Q_0'])
+    eb.status = <int*> np.PyArray_DATA(arrays['status'])
+
+    if vectorized:
+        e_bal_block(N, time_step, c_params, &eb)
+    else:
+        e_bal_scalar(N, time_step, c_params, &eb)
+
+    result = {key: arrays[key] for key in E_BAL_OUTPUTS}
+    result['e_a'] = arrays['e_a']
+    result['status'] = arrays['status'].astype(bool)
+    return result
+
+
+
+
 # We need to build an array-wrapper class to deallocate our array when
 # the Python object is deleted.
 # From https://gist.github.com/GaelVaroquaux/1249305
@@ -0,0 +1,293 @@
+"""
+Calibrate snobal parameters against observed snowpack data
+
+The forcing is prepared once and shared with every candidate. Candidates
+are evaluated in batches across worker processes. Each candidate runs in
+C (`run_grid`) in chunks of whole days, and is stopped early after a
+chunk once its accumulated error can no longer beat the best candidate
+from the previous batches.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .point_model import (
+    FREEZE, OUTPUT_OFFSET, SNOW_OUT, EM_OUT, initialize_model,
+    prepare_forcing, run_grid
+)
+
+
+LOG = logging.getLogger(__name__)
+
+# Parameters that can be calibrated. `z_0` is part of the model state,
+# the rest are passed to snobal as constants. The compaction densities in
+# `initialize_model` are compiled into the C code and are not calibratable.
+STATE_PARAMS = ['z_0']
+CONSTANT_PARAMS = ['max_h2o_vol', 'max_z_s_0', 'z_u', 'z_t', 'z_g']
+
+# Objectives are minimized internally; `kge` is stored as 1 - KGE.
+# Errors that only grow as the run goes can stop a candidate early.
+OBJECTIVES = ['rmse', 'mae', 'kge']
+EARLY_STOP_OBJECTIVES = ['rmse', 'mae']
+
+# Shared by each worker process, set once by `_init_worker`
+_CONTEXT = {}
+
+
+def kge(simulated: np.ndarray, observed: np.ndarray) -> float:
+    """
+    Kling-Gupta efficiency
+
+    Args:
+        simulated: model values
+        observed: observed values at the same times
+    Returns:
+        KGE, where 1 is a perfect fit. NaN when either series is flat
+    """
+    r = np.corrcoef(simulated, observed)[0, 1]
+    alpha = np.std(simulated) / np.std(observed)
+    beta = np.mean(simulated) / np.mean(observed)
+    return 1 - np.sqrt((r - 1) ** 2 + (alpha - 1) ** 2 + (beta - 1) ** 2)
+
+
+def _loss(objective: str, errors: np.ndarray, simulated: np.ndarray,
+          observed: np.ndarray) -> float:
+    """
+    Objective value to minimize from the matched model and observed values.
+    An undefined value (e.g. KGE of a flat series) is infinite so it never
+    wins.
+    """
+    if objective == 'rmse':
+        loss = np.sqrt(np.mean(errors ** 2))
+    elif objective == 'mae':
+        loss = np.mean(np.abs(errors))
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            loss = 1 - kge(simulated, observed)
+    return loss if np.isfinite(loss) else np.inf
+
+
+def _loss_bound(objective: str, loss: float, n_obs: int) -> float:
+    """
+    Convert an objective value to the running error total that a
+    candidate must stay below to still beat it
+    """
+    if objective == 'rmse':
+        return loss ** 2 * n_obs
+    return loss * n_obs
+
+
+def _init_worker(context: dict):
+    """
+    Store the prepared forcing and observations once per worker process
+    """
+    _CONTEXT.clear()
+    _CONTEXT.update(context)
+
+
+def _evaluate(candidate: Dict[str, float], best: float) -> Tuple[float, bool]:
+    """
+    Run the model for one candidate against the shared context
+
+    Args:
+        candidate: parameter values for this run
+        best: best objective value so far, used to stop early
+    Returns:
+        objective value and whether the run was stopped early
+    """
+    ctx = _CONTEXT
+    objective = ctx['objective']
+    observed = ctx['observed']
+    variable = ctx['variable']
+
+    output_record, tstep_info, constants, model_datetimes = initialize_model(
+        ctx['model_datetimes'], ctx['elevation'], freq=ctx['freq']
+    )
+    for key, value in candidate.items():
+        if key in STATE_PARAMS:
+            output_record[key] = np.atleast_2d(value)
+        else:
+            constants[key] = value
+
+    can_stop = objective in EARLY_STOP_OBJECTIVES and np.isfinite(best)
+    bound = _loss_bound(objective, best, len(observed))
+    running = 0.0
+    simulated = []
+    matched = []
+    forcing = ctx['forcing']
+    chunk = ctx['chunk_steps']
+    n_steps = len(model_datetimes)
+    # each chunk starts on the last timestep of the one before, carrying
+    # the state forward
+    for start in range(0, n_steps - 1, chunk):
+        steps = slice(start, min(start + chunk, n_steps - 1) + 1)
+        datetimes, output_series = run_grid(
+            model_datetimes[steps],
+            {key: value[steps] for key, value in forcing.items()},
+            output_record, tstep_info, constants
+        )
+        values = output_series[variable][:, 0, 0] - ctx['offset']
+        for tstep, value in zip(datetimes, values):
+            obs = observed.get(tstep - OUTPUT_OFFSET)
+            if obs is None:
+                continue
+            simulated.append(value)
+            matched.append(obs)
+
+            if can_stop:
+                error = value - obs
+                running += error ** 2 if objective == 'rmse' else abs(error)
+
+        if can_stop and running > bound:
+            return np.inf, True
+
+    if len(matched) == 0:
+        raise ValueError('No observations overlap the model output')
+
+    simulated = np.array(simulated)
+    matched = np.array(matched)
+    return _loss(objective, simulated - matched, simulated, matched), False
+
+
+def sample_candidates(
+        bounds: Dict[str, Tuple[float, float]], n_candidates: int,
+        seed: int = None
+) -> pd.DataFrame:
+    """
+    Latin hypercube sample of parameter sets within bounds
+
+    Args:
+        bounds: dictionary of parameter name to (min, max)
+        n_candidates: number of parameter sets
+        seed: random seed
+    Returns:
+        Dataframe with one row per candidate and one column per parameter
+    """
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for key, (low, high) in bounds.items():
+        strata = (rng.permutation(n_candidates) +
+                  rng.random(n_candidates)) / n_candidates
+        samples[key] = low + strata * (high - low)
+    return pd.DataFrame(samples)
+
+
+def calibrate(
+        forcing: pd.DataFrame, elevation: float, observed: pd.Series,
+        bounds: Dict[str, Tuple[float, float]], objective: str = 'rmse',
+        variable: str = 'specific_mass', n_candidates: int = 100,
+        batch_size: int = None, n_jobs: int = 1, seed: int = None,
+        chunk_days: int = 30
+) -> Tuple[Dict[str, float], pd.DataFrame]:
+    """
+    Calibrate snobal parameters against an observed series
+
+    Args:
+        forcing: hourly input pd.Dataframe, same as `run_model`
+        elevation: elevation in meters for the point
+        observed: observed values indexed on the output datetimes
+            (e.g. daily SWE in mm for `specific_mass`)
+        bounds: dictionary of parameter name to (min, max). Options are
+            `z_0`, `max_h2o_vol`, `max_z_s_0`, `z_u`, `z_t` and `z_g`
+        objective: one of `rmse`, `mae` or `kge`
+        variable: output variable to compare, from the `run_model` columns
+        n_candidates: number of parameter sets to try
+        batch_size: candidates per batch, defaults to `n_jobs`. The best
+            value used for stopping early is updated between batches
+        n_jobs: number of worker processes
+        seed: random seed for sampling the candidates
+        chunk_days: days run in C between checks for stopping early
+
+    Returns:
+        best parameters, Dataframe of all candidates with their objective
+        value and whether they were stopped early. Candidates where the
+        objective is undefined are stored as the worst value (inf, or
+        -inf for `kge`)
+    """
+    if objective not in OBJECTIVES:
+        raise ValueError(f'{objective} is not one of {OBJECTIVES}')
+    unknown = set(bounds) - set(STATE_PARAMS + CONSTANT_PARAMS)
+    if unknown:
+        raise ValueError(f'{sorted(unknown)} cannot be calibrated')
+    if variable in SNOW_OUT:
+        snobal_variable = SNOW_OUT[variable]
+    elif variable in EM_OUT:
+        snobal_variable = EM_OUT[variable]
+    else:
+        raise ValueError(f'{variable} is not a model output')
+
+    # Prepare everything that does not depend on the parameters once
+    # Only observations at model times can be matched, which keeps the
+    # early stopping bound tight
+    observed = observed.dropna()
+    observed = observed[
+        (observed.index + OUTPUT_OFFSET).isin(forcing.index)
+    ]
+    freq = pd.infer_freq(forcing.index)
+    _, tstep_info, _, _ = initialize_model(forcing.index, elevation, freq)
+    steps_per_day = 86400 / tstep_info[0]['time_step']
+    if steps_per_day == int(steps_per_day):
+        chunk_steps = max(int(chunk_days * steps_per_day), 1)
+    else:
+        # outputs are only daily when a day is whole timesteps
+        chunk_steps = len(forcing.index)
+
+    context = {
+        'model_datetimes': forcing.index,
+        'freq': freq,
+        'chunk_steps': chunk_steps,
+        'elevation': elevation,
+        'forcing': prepare_forcing(forcing),
+        'observed': dict(zip(observed.index, observed.to_numpy())),
+        'variable': snobal_variable,
+        'objective': objective,
+        # model temperatures are in K, outputs in C
+        'offset': FREEZE if variable.startswith('temp_') else 0.0,
+    }
+
+    df_candidates = sample_candidates(bounds, n_candidates, seed=seed)
+    candidates = df_candidates.to_dict(orient='records')
+    batch_size = batch_size or n_jobs
+
+    losses = []
+    stopped = []
+    best = np.inf
+    if n_jobs == 1:
+        _init_worker(context)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker,
+            initargs=(context,)
+        )
+
+    try:
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+            LOG.info(f'Evaluating candidates {start} to '
+                     f'{start + len(batch) - 1}')
+            if pool is None:
+                results = [_evaluate(c, best) for c in batch]
+            else:
+                results = list(pool.map(_evaluate, batch, [best] * len(batch)))
+
+            for loss, was_stopped in results:
+                losses.append(loss)
+                stopped.append(was_stopped)
+                best = min(best, loss)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    losses = np.array(losses)
+    df_candidates[objective] = 1 - losses if objective == 'kge' else losses
+    df_candidates['stopped_early'] = stopped
+
+    if not np.isfinite(losses).any():
+        raise ValueError(f'No candidate has a finite {objective}')
+    best_params = candidates[int(np.argmin(losses))]
+    return best_params, df_candidates
@@ -0,0 +1,188 @@
+"""
+Run elevation bands of a basin from a single station forcing
+
+The station forcing is lapsed to every band at once as [time, band]
+arrays and the bands are run as the pixels of one grid run, so the
+bands share the time loop and the OpenMP threads.
+"""
+
+import logging
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .point_model import (
+    MAP_INPUT_VALS, OUTPUT_COLUMNS, OUTPUT_OFFSET, TEMP_OUT,
+    initialize_model, output_table, prepare_forcing, run_grid
+)
+
+
+LOG = logging.getLogger(__name__)
+
+# Default lapse rates per meter of elevation gain. Temperatures in C/m,
+# `thermal` in W/m^2/m. The `vapor_pressure` rate is applied to the dew
+# point (C/m) so the vapor pressure stays positive.
+LAPSE_RATES = {
+    'air_temp': -0.0065,
+    'vapor_pressure': -0.002,
+    'thermal': -0.029,
+    'precip_temp': -0.0065,
+}
+
+# Basin outputs that describe the snow itself and are averaged over the
+# snow covered bands only. Amounts per unit area (mass, depth, cold
+# content) are zero without snow and are averaged over all bands.
+SNOW_PROPERTIES = TEMP_OUT + ['snow_density', 'water_saturation']
+
+# Magnus coefficients for saturation vapor pressure (Pa) over water
+MAGNUS_A = 611.2
+MAGNUS_B = 17.62
+MAGNUS_C = 243.12
+
+
+def dew_point(vapor_pressure: np.ndarray) -> np.ndarray:
+    """
+    Dew point in C from vapor pressure in Pa (Magnus formula)
+    """
+    x = np.log(vapor_pressure / MAGNUS_A)
+    return MAGNUS_C * x / (MAGNUS_B - x)
+
+
+def vapor_pressure_at(dew_point: np.ndarray) -> np.ndarray:
+    """
+    Vapor pressure in Pa at a dew point in C (Magnus formula)
+    """
+    return MAGNUS_A * np.exp(MAGNUS_B * dew_point / (MAGNUS_C + dew_point))
+
+
+def lapse_forcing(
+        forcing: dict, station_elevation: float,
+        band_elevations: np.ndarray, lapse_rates: Dict[str, float]
+) -> dict:
+    """
+    Lapse prepared station forcing to each band
+
+    Args:
+        forcing: prepared station inputs from `prepare_forcing`
+        station_elevation: elevation of the station in meters
+        band_elevations: elevation of each band in meters
+        lapse_rates: rates for `air_temp`, `vapor_pressure`, `thermal`
+            and `precip_temp`, see LAPSE_RATES
+
+    Returns:
+        dictionary of [time, band] arrays of snobal inputs
+    """
+    dz = (np.asarray(band_elevations, dtype=np.float64) -
+          station_elevation)[None, :]
+    n_bands = dz.shape[1]
+
+    result = {
+        key: np.repeat(value[:, None], n_bands, axis=1)
+        for key, value in forcing.items()
+    }
+    for name in ['air_temp', 'thermal', 'precip_temp']:
+        key = MAP_INPUT_VALS[name]
+        result[key] = forcing[key][:, None] + lapse_rates[name] * dz
+
+    # lapse the dew point, no vapor stays no vapor
+    e_a = forcing['e_a'][:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e_band = vapor_pressure_at(
+            dew_point(e_a) + lapse_rates['vapor_pressure'] * dz
+        )
+    result['e_a'] = np.where(e_a > 0, e_band, e_a)
+
+    # no negative longwave
+    result['I_lw'] = np.maximum(result['I_lw'], 0.0)
+
+    return result
+
+
+def run_elevation_bands(
+        df_inputs: pd.DataFrame, station_elevation: float,
+        band_elevations: Sequence[float], lapse_rates: Dict[str, float] = None,
+        band_areas: Sequence[float] = None, nthreads: int = 1
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Run snobal for each elevation band of a basin from station forcing
+
+    Args:
+        df_inputs: hourly input pd.Dataframe for the station, same as
+            `run_model`
+        station_elevation: elevation of the station in meters
+        band_elevations: elevation of each band in meters
+        lapse_rates: rates to change from LAPSE_RATES, per meter
+        band_areas: area of each band for the basin mean, equal areas
+            when not given
+        nthreads: number of threads for the C model
+
+    Returns:
+        Dataframe of daily outputs of each band indexed on band elevation
+        and datetime, Dataframe of the area weighted mean of the bands.
+        The basin values are per unit area (e.g. mm of SWE over the
+        basin), not totals; multiply by the basin area for a total. The
+        SNOW_PROPERTIES (snow temperatures, density and water saturation)
+        are only averaged over the bands with snow and are NaN when there
+        is no snow.
+    """
+    band_elevations = np.asarray(band_elevations, dtype=np.float64)
+    if band_elevations.ndim != 1 or band_elevations.size == 0:
+        raise ValueError('band_elevations must be a list of elevations')
+
+    if band_areas is None:
+        band_areas = np.ones(band_elevations.shape)
+    band_areas = np.asarray(band_areas, dtype=np.float64)
+    if band_areas.shape != band_elevations.shape:
+        raise ValueError('band_areas must have one area per band')
+
+    rates = dict(LAPSE_RATES)
+    if lapse_rates is not None:
+        unknown = set(lapse_rates) - set(LAPSE_RATES)
+        if unknown:
+            raise ValueError(f'No lapse rate for {sorted(unknown)}')
+        rates.update(lapse_rates)
+
+    # the bands are the pixels of a [1, n_bands] grid
+    elevation = band_elevations[None, :]
+    output_record, tstep_info, constants, model_datetimes = initialize_model(
+        df_inputs.index, elevation)
+    forcing = lapse_forcing(
+        prepare_forcing(df_inputs), station_elevation, band_elevations,
+        rates
+    )
+
+    LOG.info(f'Running {band_elevations.size} elevation bands')
+    datetimes, output_series = run_grid(
+        model_datetimes, forcing, output_record, tstep_info, constants,
+        nthreads=nthreads
+    )
+
+    # [band, output, column]
+    values = np.stack([
+        output_table(output_series, pixel=(0, b))
+        for b in range(band_elevations.size)
+    ])
+    datetimes = pd.Index(datetimes - OUTPUT_OFFSET, name='datetime')
+    df_bands = pd.DataFrame(
+        values.reshape(-1, len(OUTPUT_COLUMNS)),
+        index=pd.MultiIndex.from_product(
+            [band_elevations, datetimes], names=['elevation', 'datetime']
+        ),
+        columns=OUTPUT_COLUMNS
+    )
+
+    # area weighted mean over the bands, properties of the snow itself
+    # over the bands that have snow
+    weights = np.broadcast_to(
+        band_areas[:, None, None], values.shape
+    ).copy()
+    snow_only = [OUTPUT_COLUMNS.index(c) for c in SNOW_PROPERTIES]
+    no_snow = values[:, :, OUTPUT_COLUMNS.index('specific_mass')] <= 0
+    weights[:, :, snow_only] *= ~no_snow[:, :, None]
+    total = weights.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        basin = (values * weights).sum(axis=0) / total
+    df_basin = pd.DataFrame(basin, index=datetimes, columns=OUTPUT_COLUMNS)
+
+    return df_bands, df_basin
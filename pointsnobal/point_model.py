@@ -4,7 +4,7 @@ Created: November 2024
 """
 
 import copy
-from typing import List
+from typing import List, Tuple
 import logging
 
 import numpy as np
@@ -19,6 +19,9 @@ LOG = logging.getLogger(__name__)
 C_TO_K = 273.16
 FREEZE = C_TO_K
 
+# Output records are labelled one hour before the model timestep
+OUTPUT_OFFSET = pd.to_timedelta("1 hour")
+
 
 # Map of our CSV values to expected snobal inputs
 MAP_INPUT_VALS = {'air_temp': 'T_a', 'net_solar': 'S_n', 'thermal': 'I_lw',
@@ -43,24 +46,33 @@ SNOW_OUT = {'thickness': 'z_s', 'snow_density': 'rho',
             'temp_snowcover': 'T_s', 'thickness_lower': 'z_s_l',
             'water_saturation': 'h2o_sat'}
 
+# Columns of the `run_model` output, those in TEMP_OUT are in C
+OUTPUT_COLUMNS = list({**EM_OUT, **SNOW_OUT})
+TEMP_OUT = ['temp_snowcover', 'temp_surf', 'temp_lower']
+
 
 def initialize_model(
         model_datetimes: pd.DatetimeIndex, elevation: float,
+        freq: str = None
 ):
     """
     Args:
         model_datetimes: datetime index from the forcing data
         elevation: elevation in meters
+        freq: frequency of the forcing data, inferred from
+            model_datetimes when not given
 
     Returns:
-        output_record: output dictionary for start (mostly 0.0s)
+        output_record: output dictionary for start (mostly 0.0s), each
+            array shaped like the 2D elevation
         tstep_info: Information for dynamic timestepping
         constants: Dictionary of constants for snobal
         model_datetimes: a list of datetimes for which to run the model
     """
     # initialize isnobal state
     LOG.info('Initializing snobal Model')
-    freq = pd.infer_freq(model_datetimes)
+    if freq is None:
+        freq = pd.infer_freq(model_datetimes)
     # Convert to offset and calculate number of minutes
     offset = pd.tseries.frequencies.to_offset(freq)
     constants = {
@@ -78,6 +90,8 @@ def initialize_model(
             'max_density': 550,
             'max_compact_density': 500,
             'max_liquid_density': 500,
+            # start hle1 from the last Obukhov length, False for neutral
+            'warm_start': True,
         }
 
     # get the timestep info
@@ -94,10 +108,10 @@ def initialize_model(
         {'level': 3, 'output': False, 'threshold': 1.0, 'time_step': 60.0,
         'intervals': 15}
     ]
-    # get init params
-    dem = np.atleast_2d(elevation)
-    mask = np.atleast_2d(1)
-    roughness = np.atleast_2d(0.005)
+    # get init params, one value per pixel of the elevation grid
+    dem = np.atleast_2d(np.asarray(elevation, dtype=np.float64)).copy()
+    mask = np.ones(dem.shape, dtype=np.int32)
+    roughness = np.full(dem.shape, 0.005)
 
     output_record = {
         'mask': mask, 'elevation': dem,
@@ -114,7 +128,10 @@ def initialize_model(
         'ro_pred_sum',
         'current_time', 'time_since_out'
     ]:
-        output_record[key] = np.atleast_2d(0.0)
+        output_record[key] = np.zeros(dem.shape)
+
+    # no Obukhov stability length yet, hle1 starts from neutral
+    output_record['obukhov_lo'] = np.full(dem.shape, np.inf)
 
     return output_record, tstep_info, constants, model_datetimes
 
@@ -149,6 +166,35 @@ def get_timestep_force(df_inputs: pd.DataFrame, tstep: pd.Timestamp):
     return result
 
 
+def prepare_forcing(df_inputs: pd.DataFrame) -> dict:
+    """
+    Convert the forcing dataframe to arrays of snobal inputs once, so the
+    time loop only has to index into them
+
+    Args:
+        df_inputs: all hourly inputs in a dataframe
+    Returns:
+        dictionary of 1D arrays of snobal inputs, one value per timestep
+    """
+    result = {}
+
+    # map function from these values to the ones required by snobal
+    for f in df_inputs.columns:
+        # expected input name for snobal
+        if f in MAP_INPUT_VALS:
+            result[MAP_INPUT_VALS[f]] = df_inputs[f].to_numpy(
+                dtype=np.float64)
+        else:
+            LOG.debug(f"{f} is not a known mapping input")
+
+    # convert from C to K
+    result['T_a'] = result['T_a'] + FREEZE
+    result['T_pp'] = result['T_pp'] + FREEZE
+    result['T_g'] = result['T_g'] + FREEZE
+
+    return result
+
+
 def save_timsteps(
         output_list: List[dict], output_records: dict, tstep: pd.Timestamp
 ):
@@ -178,12 +224,175 @@ def save_timsteps(
     record['temp_surf'] -= FREEZE
     record['temp_lower'] -= FREEZE
 
-    record['datetime'] = tstep - pd.to_timedelta("1 hour")
+    record['datetime'] = tstep - OUTPUT_OFFSET
 
     output_list.append(record)
     return output_list
 
 
+def output_steps(n_steps: int, tstep_info: List[dict]) -> np.ndarray:
+    """
+    Which timesteps produce an output record: daily and the last timestep
+
+    Args:
+        n_steps: number of model timesteps, including the first
+        tstep_info: Information for dynamic timestepping
+    Returns:
+        boolean array with one value per timestep
+    """
+    # Get the timestep for the data (first index of the isnobal tstep list)
+    data_tstep = tstep_info[0]['time_step']
+    j = np.arange(n_steps)
+    steps = (j * (data_tstep / 3600.0) % 24 == 0) | (j == n_steps - 1)
+    # the first timestep only provides the starting inputs
+    steps[0] = False
+    return steps
+
+
+def aggregation_steps(
+        n_steps: int, freq: str, tstep_info: List[dict]
+) -> Tuple[int, np.ndarray]:
+    """
+    Data timesteps per aggregation period and the timestep that ends
+    each period. Periods start at the first model timestep and the last
+    one ends at the last timestep.
+
+    Args:
+        n_steps: number of model timesteps, including the first
+        freq: aggregation period as a pandas frequency, e.g. `1D` or `6h`
+        tstep_info: Information for dynamic timestepping
+    Returns:
+        timesteps per period, index of the last timestep of each period
+    """
+    data_tstep = tstep_info[0]['time_step']
+    period = pd.to_timedelta(freq).total_seconds() / data_tstep
+    if period < 1 or period != int(period):
+        raise ValueError(
+            f'{freq} is not a multiple of the {data_tstep}s data timestep'
+        )
+    period = int(period)
+    ends = np.minimum(
+        np.arange(period, n_steps - 1 + period, period), n_steps - 1
+    )
+    return period, ends
+
+
+def run_grid(
+        model_datetimes: pd.DatetimeIndex, forcing: dict, output_record: dict,
+        tstep_info: List[dict], constants: dict, nthreads: int = 1,
+        schedule: str = 'static', chunk: int = 0, first_touch: bool = True,
+        aggregators: dict = None
+):
+    """
+    Run the whole time loop in C, keeping one OpenMP parallel region
+    open across all timesteps. The state at each output timestep is
+    stored in arrays instead of being returned to python every step.
+
+    Aggregators are computed in the same C time loop after every data
+    timestep, e.g. for daily minimum surface temperature and peak hourly
+    melt::
+
+        aggregators = {
+            'T_s_0_min': ('T_s_0', 'min', '1D'),
+            'peak_melt': ('melt', 'max', '1D'),
+            'R_n_6h': ('R_n', 'mean', '6h'),
+        }
+
+    Args:
+        model_datetimes: datetimes for which to run the model
+        forcing: prepared inputs from `prepare_forcing`, each with one
+            row per timestep and one column per pixel
+        output_record: model state from `initialize_model`
+        tstep_info: Information for dynamic timestepping
+        constants: Dictionary of constants for snobal
+        nthreads: number of threads for the C model
+        schedule: OpenMP schedule over pixels, `static`, `dynamic`,
+            `guided` or `auto`
+        chunk: chunk size for the schedule, 0 for the OpenMP default
+        first_touch: allocate the model state in the threads that use it,
+            which keeps it on their NUMA node with the static schedule
+        aggregators: dictionary of name to (variable, statistic, freq).
+            variable is one of `snobal.AGG_VARIABLES` (state variables at
+            the end of each data timestep, fluxes as the mean and mass
+            totals as the sum over it), statistic one of `mean`, `min`,
+            `max` or `sum` and freq a pandas frequency that is a multiple
+            of the data timestep. The snow temperatures, density and
+            saturation only take the timesteps with snow (`T_s_l` with a
+            lower layer) and are NaN for periods without
+
+    Returns:
+        output datetimes, dictionary of model state arrays shaped
+        [n_outputs, *elevation.shape]. With aggregators, also a
+        dictionary of name to (period end datetimes, array shaped
+        [n_periods, *elevation.shape])
+    """
+    n_steps = len(model_datetimes)
+    shape = output_record['elevation'].shape
+    n_pixels = output_record['elevation'].size
+
+    # Tracking how often we output
+    output_record['current_time'] = np.zeros(shape)
+    output_record['time_since_out'] = np.zeros(shape)
+
+    steps = output_steps(n_steps, tstep_info)
+    inputs = {
+        key: np.reshape(value, (n_steps, n_pixels))
+        for key, value in forcing.items()
+    }
+    output_series = {
+        key: np.zeros(
+            (steps.sum(),) + shape,
+            dtype=np.int32 if key in snobal.INT_STATE_KEYS else np.float64
+        )
+        for key in output_record
+    }
+
+    aggregates = {}
+    c_aggregators = []
+    for name, (variable, stat, freq) in (aggregators or {}).items():
+        period, ends = aggregation_steps(n_steps, freq, tstep_info)
+        # masked pixels are never aggregated
+        values = np.full((len(ends),) + shape, np.nan)
+        aggregates[name] = (model_datetimes[ends], values)
+        c_aggregators.append((variable, stat, period, values))
+
+    LOG.debug('starting pointsnobal grid run')
+    snobal.do_tstep_series(
+        inputs, output_record, tstep_info, constants, constants, steps,
+        output_series, nthreads=nthreads, schedule=schedule, chunk=chunk,
+        first_touch=first_touch, aggregators=c_aggregators
+    )
+
+    if aggregators is None:
+        return model_datetimes[steps], output_series
+    return model_datetimes[steps], output_series, aggregates
+
+
+def output_table(
+        output_series: dict, out: np.ndarray = None, pixel: tuple = (0, 0)
+) -> np.ndarray:
+    """
+    Table of the `run_model` outputs for a single point
+
+    Args:
+        output_series: model state arrays from `run_grid`
+        out: optional [n_outputs, len(OUTPUT_COLUMNS)] array to fill
+        pixel: index of the point in the model grid
+
+    Returns:
+        array with one row per output and one column per OUTPUT_COLUMNS
+    """
+    names = {**EM_OUT, **SNOW_OUT}
+    if out is None:
+        out = np.empty((len(output_series['m_s']), len(OUTPUT_COLUMNS)))
+    for i, key in enumerate(OUTPUT_COLUMNS):
+        out[:, i] = output_series[names[key]][(slice(None),) + pixel]
+        # convert from K to C
+        if key in TEMP_OUT:
+            out[:, i] -= FREEZE
+    return out
+
+
 def run_model(
         start: pd.Timestamp, end: pd.Timestamp, elevation: float,
         df_inputs: pd.DataFrame
@@ -199,66 +408,19 @@ def run_model(
     Returns:
         Dataframe of daily outputs indexed on datetime
     """
-    # Returns '=1H'
-    frequency = pd.infer_freq(df_inputs.index)
-    # Variable for storing the outputs
-    output_list = []
     # Get the variables for snobal
     output_record, tstep_info, constants, model_datetimes = initialize_model(
         df_inputs.index, elevation)
+    forcing = prepare_forcing(df_inputs)
 
-    # Tracking how often we output
-    output_record['current_time'] = 1.0 * np.zeros(
-        output_record['elevation'].shape)
-    output_record['time_since_out'] = 1.0 * np.zeros(
-        output_record['elevation'].shape)
-
-    # Get the timestep for the data (first index of the isnobal tstep list)
-    data_tstep = tstep_info[0]['time_step']
-    LOG.debug('Reading inputs for first timestep')
-
-    # Get the initial inputs
-    input1 = get_timestep_force(df_inputs, model_datetimes[0])
-    LOG.debug('starting pointsnobal time series loop')
-    j = 1
-    # Iterate through the rest of the timesteps to run snobal
-    for tstep in model_datetimes[1:]:
-        LOG.debug(
-            'running snobal for timestep: {}'.format(tstep)
-        )
-        # Get the next inputs
-        input2 = get_timestep_force(df_inputs, tstep)
-
-        first_step = j
-
-        # Run the model
-        rt = snobal.do_tstep_grid(
-            input1, input2, output_record, tstep_info,
-            constants, constants,
-            first_step=first_step,
-            nthreads=1)
-
-        if rt != -1:
-            raise ValueError(f'pointsnobal error on time step {tstep}')
-
-        # copy the second inputs to now be the starting inputs
-        input1 = copy.deepcopy(input2)
-
-        # output at the frequency and the last time step
-        if (j * (data_tstep / 3600.0) % 24 == 0) \
-                or (j == len(model_datetimes) - 1):
-            LOG.debug('Outputting {}'.format(tstep))
-
-            # write timesep to the final dataframe
-            output_list = save_timsteps(output_list, output_record, tstep)
-            # Store a zero array in time since out since we just output
-            output_record['time_since_out'] = np.zeros(
-                output_record['elevation'].shape
-            )
-
-        LOG.debug('Finished timestep: {}'.format(tstep))
+    datetimes, output_series = run_grid(
+        model_datetimes, forcing, output_record, tstep_info, constants
+    )
 
-        j += 1
+    df_out = pd.DataFrame(
+        output_table(output_series),
+        index=pd.Index(datetimes - OUTPUT_OFFSET, name="datetime"),
+        columns=OUTPUT_COLUMNS
+    )
 
-    df_out = pd.DataFrame.from_records(output_list)
-    return df_out.set_index("datetime")
+    return df_out
@@ -0,0 +1,257 @@
+"""
+Run many stations across worker processes with shared memory results
+
+Every station's outputs are written by the worker straight into one
+preallocated `multiprocessing.shared_memory` block, so nothing but the
+station index is sent back to the parent. The block is a single
+[n_rows, len(OUTPUT_COLUMNS)] float64 table with the stations stacked
+one after another. The parent reads it through copies, or zero-copy
+views that keep the block from being closed while they are in use.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import logging
+from multiprocessing import shared_memory
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from .point_model import (
+    OUTPUT_COLUMNS, OUTPUT_OFFSET, initialize_model, output_steps,
+    output_table, prepare_forcing, run_grid
+)
+
+
+LOG = logging.getLogger(__name__)
+
+# Shared by each worker process, set once by `_init_worker`
+_CONTEXT = {}
+
+
+class StationResults:
+    """
+    Outputs of `run_stations` in a shared memory block. DataFrames are
+    copies of the block unless asked for with `copy=False`. Views hold
+    the block open: `close` raises a BufferError while any view, including
+    `values`, is still referenced outside of this object.
+
+    Attributes:
+        stations: station names, in the order they are stored
+        offsets: first row of each station, with the total rows at the end
+        datetimes: output datetime of every row
+        values: [n_rows, len(OUTPUT_COLUMNS)] view of the block
+    """
+
+    def __init__(self, stations: list, offsets: np.ndarray,
+                 datetimes: pd.DatetimeIndex):
+        self.stations = list(stations)
+        self.offsets = offsets
+        self.datetimes = datetimes
+        shape = (int(offsets[-1]), len(OUTPUT_COLUMNS))
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * 8, 1)
+        )
+        # every array made from the mapping holds an export of it, so it
+        # can not be unmapped while any of them is alive
+        self._mmap = self._shm.buf.obj
+        self.values = self._view()
+        self.values[:] = np.nan
+
+    def _view(self) -> np.ndarray:
+        """
+        View of the block as a [n_rows, len(OUTPUT_COLUMNS)] array
+        """
+        shape = (int(self.offsets[-1]), len(OUTPUT_COLUMNS))
+        return np.asarray(self._mmap)[:int(np.prod(shape)) * 8].view(
+            np.float64).reshape(shape)
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block"""
+        return self._shm.name
+
+    def station(self, station: str, copy: bool = True) -> pd.DataFrame:
+        """
+        Outputs of one station, the same as `run_model` returns
+
+        Args:
+            station: station name
+            copy: copy the outputs out of the block, otherwise the
+                Dataframe is a view of it
+        Returns:
+            Dataframe of daily outputs indexed on datetime
+        """
+        i = self.stations.index(station)
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return pd.DataFrame(
+            self.values[rows], index=self.datetimes[rows],
+            columns=OUTPUT_COLUMNS, copy=copy
+        )
+
+    def to_dataframe(self, copy: bool = True) -> pd.DataFrame:
+        """
+        All stations in one Dataframe indexed on station and datetime
+
+        Args:
+            copy: copy the outputs out of the block, otherwise the
+                Dataframe is a view of it
+        """
+        index = pd.MultiIndex.from_arrays(
+            [np.repeat(self.stations, np.diff(self.offsets)),
+             self.datetimes],
+            names=['station', 'datetime']
+        )
+        return pd.DataFrame(
+            self.values, index=index, columns=OUTPUT_COLUMNS, copy=copy
+        )
+
+    def to_parquet(self, path: str, **kwargs):
+        """
+        Write all stations to one Parquet file. Needs a pandas Parquet
+        engine (pyarrow or fastparquet).
+
+        Args:
+            path: output file
+            kwargs: passed to `pd.DataFrame.to_parquet`
+        """
+        self.to_dataframe(copy=False).reset_index().to_parquet(
+            path, index=False, **kwargs
+        )
+
+    def close(self):
+        """
+        Release and remove the shared memory block
+
+        Raises:
+            BufferError: views of the block are still in use
+        """
+        if self.values is None:
+            return
+        self.values = None
+        try:
+            self._shm.close()
+        except BufferError:
+            self.values = self._view()
+            raise BufferError(
+                'Views of the station results are still in use, delete '
+                'them or copy them before closing'
+            ) from None
+        self._shm.unlink()
+
+    def _discard(self):
+        """
+        Remove the block after a failed run. Views in the traceback may
+        still hold it, then it is unmapped once the last one is gone.
+        """
+        self.values = None
+        try:
+            self._shm.close()
+        except BufferError:
+            pass
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _init_worker(name: str, shape: tuple):
+    """
+    Attach to the shared output block once per worker process
+    """
+    # worker processes share the parent's resource tracker, which removes
+    # the block if the parent dies without closing it
+    shm = shared_memory.SharedMemory(name=name)
+    _CONTEXT.clear()
+    _CONTEXT['shm'] = shm
+    _CONTEXT['values'] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+
+
+def _run_station(i: int, elevation: float, df_inputs: pd.DataFrame,
+                 offset: int) -> int:
+    """
+    Run one station and write its outputs into the shared block from row
+    offset
+    """
+    output_record, tstep_info, constants, model_datetimes = initialize_model(
+        df_inputs.index, elevation)
+    _, output_series = run_grid(
+        model_datetimes, prepare_forcing(df_inputs), output_record,
+        tstep_info, constants
+    )
+    n_out = len(output_series['m_s'])
+    output_table(
+        output_series, out=_CONTEXT['values'][offset:offset + n_out]
+    )
+    return i
+
+
+def run_stations(
+        inputs: Dict[str, pd.DataFrame], elevations: Dict[str, float],
+        n_jobs: int = 1
+) -> StationResults:
+    """
+    Run `run_model` for many stations across worker processes, with the
+    results written to shared memory instead of pickled back
+
+    Args:
+        inputs: dictionary of station name to hourly input pd.Dataframe
+        elevations: dictionary of station name to elevation in meters
+        n_jobs: number of worker processes
+
+    Returns:
+        StationResults holding the outputs of every station. Close it (or
+        use it as a context manager) to free the shared memory
+    """
+    missing = set(inputs) - set(elevations)
+    if missing:
+        raise ValueError(f'No elevation for stations {sorted(missing)}')
+
+    # The output rows only depend on the forcing datetimes, lay out the
+    # block before running anything
+    stations = list(inputs)
+    counts = []
+    datetimes = []
+    for station in stations:
+        index = inputs[station].index
+        _, tstep_info, _, _ = initialize_model(index, elevations[station])
+        steps = output_steps(len(index), tstep_info)
+        counts.append(steps.sum())
+        datetimes.append(index[steps] - OUTPUT_OFFSET)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(int)
+    datetimes = pd.DatetimeIndex(
+        np.concatenate(datetimes) if datetimes else [], name='datetime'
+    )
+
+    results = StationResults(stations, offsets, datetimes)
+    initargs = (results.name, results.values.shape)
+    args = (
+        range(len(stations)),
+        [elevations[s] for s in stations],
+        [inputs[s] for s in stations],
+        offsets[:-1],
+    )
+    try:
+        if n_jobs == 1:
+            _CONTEXT.clear()
+            _CONTEXT['values'] = results.values
+            try:
+                for i in map(_run_station, *args):
+                    LOG.debug(f'Finished station {stations[i]}')
+            finally:
+                _CONTEXT.clear()
+        else:
+            with ProcessPoolExecutor(
+                    max_workers=n_jobs, initializer=_init_worker,
+                    initargs=initargs
+            ) as pool:
+                for i in pool.map(_run_station, *args):
+                    LOG.debug(f'Finished station {stations[i]}')
+    except BaseException:
+        results._discard()
+        raise
+
+    return results
@@ -0,0 +1,91 @@
+"""
+Thread scaling report for the grid run mode
+
+Replicates a forcing file across N pixels and times `run_grid` for each
+thread count and schedule, printing wall time, speedup and efficiency
+relative to one thread.
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from pointsnobal.point_model import initialize_model, prepare_forcing, run_grid
+
+
+def time_run(model_datetimes, forcing, elevations, nthreads, schedule, chunk,
+             first_touch):
+    output_record, tstep_info, constants, _ = initialize_model(
+        model_datetimes, elevations
+    )
+    start = time.perf_counter()
+    run_grid(
+        model_datetimes, forcing, output_record, tstep_info, constants,
+        nthreads=nthreads, schedule=schedule, chunk=chunk,
+        first_touch=first_touch
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Thread scaling report for the pointsnobal grid run'
+    )
+    parser.add_argument(
+        '--csv_file', type=str,
+        default=str(Path(__file__).parent.parent.joinpath(
+            'tests/data/inputs_csl_2023.csv')),
+        help='forcing file to replicate across pixels')
+    parser.add_argument(
+        '--pixels', type=int, default=10000,
+        help='number of pixels')
+    parser.add_argument(
+        '--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64],
+        help='thread counts to run')
+    parser.add_argument(
+        '--schedules', type=str, nargs='+',
+        default=['static', 'dynamic', 'guided'],
+        help='OpenMP schedules to run')
+    parser.add_argument(
+        '--chunk', type=int, default=0,
+        help='chunk size for the schedule, 0 for the OpenMP default')
+    parser.add_argument(
+        '--no_first_touch', action='store_true',
+        help='use the numpy state buffers instead of first touch')
+    args = parser.parse_args()
+
+    df = pd.read_csv(
+        args.csv_file, parse_dates=['datetime'], index_col='datetime'
+    )
+    forcing = {
+        key: np.repeat(value[:, None], args.pixels, axis=1)
+        for key, value in prepare_forcing(df).items()
+    }
+    # spread the pixels over a range of elevations
+    elevations = np.atleast_2d(np.linspace(1500.0, 3500.0, args.pixels))
+
+    rows = []
+    for schedule in args.schedules:
+        base = None
+        for nthreads in args.threads:
+            seconds = time_run(
+                df.index, forcing, elevations, nthreads, schedule,
+                args.chunk, not args.no_first_touch
+            )
+            base = base or seconds
+            rows.append({
+                'schedule': schedule, 'threads': nthreads,
+                'seconds': seconds, 'speedup': base / seconds,
+                'efficiency': base / seconds / nthreads
+            })
+
+    print(f'{args.pixels} pixels, {len(df)} timesteps, '
+          f'{os.cpu_count()} cpus')
+    print(pd.DataFrame(rows).to_string(index=False, float_format='%.3f'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+from pointsnobal.calibration import (
+    _loss, calibrate, kge, sample_candidates
+)
+from pointsnobal.point_model import run_model
+
+
+class TestCalibration:
+    TEST_FILE = Path(__file__).parent.joinpath(
+        "data/inputs_csl_2023.csv"
+    )
+
+    @pytest.fixture(scope="class")
+    def test_data(self):
+        return pd.read_csv(
+            self.TEST_FILE,
+            parse_dates=["datetime"], index_col="datetime"
+        )
+
+    @pytest.fixture(scope="class")
+    def observed(self, test_data):
+        result = run_model(
+            test_data.index.min(), test_data.index.max(), 2103.0, test_data
+        )
+        return result["specific_mass"]
+
+    def test_sample_candidates(self):
+        df = sample_candidates(
+            {"z_0": (0.001, 0.01), "max_h2o_vol": (0.01, 0.05)}, 10, seed=1
+        )
+        assert len(df) == 10
+        assert df["z_0"].between(0.001, 0.01).all()
+        # one sample in each stratum
+        strata = np.floor((df["max_h2o_vol"] - 0.01) / 0.004)
+        assert sorted(strata) == list(range(10))
+
+    def test_kge_perfect(self):
+        values = np.array([1.0, 2.0, 4.0])
+        assert kge(values, values) == pytest.approx(1.0)
+
+    def test_kge_flat(self):
+        # a flat series has no correlation, its KGE is undefined and the
+        # candidate must rank last
+        observed = np.array([1.0, 2.0, 4.0])
+        simulated = np.zeros(3)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            assert np.isnan(kge(simulated, observed))
+        assert _loss(
+            "kge", simulated - observed, simulated, observed
+        ) == np.inf
+
+    def test_calibrate_kge_no_snow(self, test_data, observed):
+        # no snow on the observed days, every candidate is flat
+        no_snow = observed[observed == 0]
+        with pytest.raises(ValueError, match="finite kge"):
+            calibrate(
+                test_data, 2103.0, no_snow, {"z_0": (0.001, 0.01)},
+                objective="kge", n_candidates=2
+            )
+
+    def test_calibrate_recovers_default(self, test_data, observed):
+        best, df = calibrate(
+            test_data, 2103.0, observed, {"z_0": (0.005, 0.005)},
+            n_candidates=2
+        )
+        assert best["z_0"] == pytest.approx(0.005)
+        assert df["rmse"].tolist() == [0.0, 0.0]
+
+    def test_calibrate_chunks(self, test_data, observed):
+        # running in chunks carries the state over exactly
+        results = [
+            calibrate(
+                test_data, 2103.0, observed, {"z_0": (0.001, 0.01)},
+                n_candidates=2, seed=3, batch_size=2, chunk_days=chunk_days
+            )[1]
+            for chunk_days in [1, 7, 1000]
+        ]
+        pd.testing.assert_frame_equal(results[0], results[1])
+        pd.testing.assert_frame_equal(results[0], results[2])
+
+    def test_calibrate_stops_early(self, test_data, observed):
+        best, df = calibrate(
+            test_data, 2103.0, observed,
+            {"z_0": (0.001, 0.05), "max_h2o_vol": (0.01, 0.1)},
+            n_candidates=4, seed=10
+        )
+        assert len(df) == 4
+        stopped = df[df["stopped_early"]]
+        assert np.isinf(stopped["rmse"]).all()
+        assert np.isfinite(df["rmse"]).any()
+        assert best == df.loc[df["rmse"].idxmin(), ["z_0", "max_h2o_vol"]]\
+            .to_dict()
+
+    def test_calibrate_bad_parameter(self, test_data, observed):
+        with pytest.raises(ValueError):
+            calibrate(
+                test_data, 2103.0, observed, {"max_density": (500, 600)}
+            )
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from pointsnobal.c_snobal import snobal
+
+
+MH = {"z_u": 5.0, "z_t": 2.0, "z_g": 0.3, "relative_heights": True}
+
+
+def make_inputs(n, seed=0):
+    """
+    Random but physically plausible energy balance inputs
+    """
+    rng = np.random.default_rng(seed)
+    z_s = rng.uniform(0.05, 2.0, n)
+    z_s_0 = np.minimum(z_s, 0.25)
+    T_s_0 = rng.uniform(245.0, 273.16, n)
+    return {
+        "layer_count": rng.integers(0, 3, n),
+        "precip_now": rng.integers(0, 2, n),
+        "S_n": rng.uniform(0.0, 600.0, n),
+        "I_lw": rng.uniform(150.0, 350.0, n),
+        "T_a": rng.uniform(250.0, 285.0, n),
+        "e_a": rng.uniform(50.0, 900.0, n),
+        "u": rng.uniform(0.2, 10.0, n),
+        "T_g": rng.uniform(268.0, 280.0, n),
+        "P_a": rng.uniform(65000.0, 90000.0, n),
+        "z_0": np.full(n, 0.005),
+        "z_s": z_s,
+        "z_s_0": z_s_0,
+        "z_s_l": z_s - z_s_0,
+        "rho": rng.uniform(100.0, 500.0, n),
+        "T_s_0": T_s_0,
+        "T_s_l": np.minimum(T_s_0 + rng.uniform(-5.0, 5.0, n), 273.16),
+        "m_rain": rng.uniform(0.0, 2.0, n),
+        "m_snow": rng.uniform(0.0, 2.0, n),
+        "T_rain": rng.uniform(273.16, 278.0, n),
+        "T_snow": rng.uniform(260.0, 273.16, n),
+    }
+
+
+class TestEBal:
+
+    @pytest.fixture(scope="class")
+    def inputs(self):
+        return make_inputs(1000)
+
+    @pytest.mark.parametrize("relative_heights", [True, False])
+    def test_block_matches_scalar(self, inputs, relative_heights):
+        mh = {**MH, "relative_heights": relative_heights}
+        block = snobal.e_bal(inputs, mh, 3600.0, vectorized=True)
+        scalar = snobal.e_bal(inputs, mh, 3600.0, vectorized=False)
+
+        np.testing.assert_array_equal(block["status"], scalar["status"])
+        ok = scalar["status"]
+        assert ok.mean() > 0.9
+        for key in snobal.E_BAL_OUTPUTS + ["e_a"]:
+            np.testing.assert_allclose(
+                block[key][ok], scalar[key][ok], rtol=1e-10, atol=1e-10
+            )
+
+    @pytest.mark.parametrize("relative_heights", [True, False])
+    def test_energy_budget(self, inputs, relative_heights):
+        mh = {**MH, "relative_heights": relative_heights}
+        result = snobal.e_bal(inputs, mh, 3600.0)
+        ok = result["status"]
+        assert ok.mean() > 0.9
+
+        np.testing.assert_allclose(
+            result["delta_Q_0"][ok],
+            (result["R_n"] + result["H"] + result["L_v_E"] +
+             result["G_0"] + result["M"])[ok]
+        )
+        two_layers = ok & (inputs["layer_count"] == 2)
+        np.testing.assert_allclose(
+            result["delta_Q"][two_layers],
+            (result["delta_Q_0"] + result["G"] - result["G_0"])[two_layers]
+        )
+
+    def test_no_snow(self, inputs):
+        result = snobal.e_bal(inputs, MH, 3600.0)
+        no_snow = inputs["layer_count"] == 0
+        for key in snobal.E_BAL_OUTPUTS:
+            assert (result[key][no_snow] == 0.0).all()
+
+    @pytest.mark.parametrize("vectorized", [True, False])
+    def test_bad_input_flagged(self, vectorized):
+        inputs = make_inputs(3)
+        inputs["layer_count"][:] = 1
+        # roughness above the measurement height
+        inputs["z_0"][1] = 3.0
+        result = snobal.e_bal(inputs, MH, 3600.0, vectorized=vectorized)
+        assert result["status"].tolist() == [True, False, True]
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+from pointsnobal.elevation_bands import (
+    dew_point, run_elevation_bands, vapor_pressure_at
+)
+from pointsnobal.point_model import run_model
+
+
+class TestElevationBands:
+    TEST_FILE = Path(__file__).parent.joinpath(
+        "data/inputs_csl_2023.csv"
+    )
+    BANDS = [1800.0, 2103.0, 2500.0]
+
+    @pytest.fixture(scope="class")
+    def test_data(self):
+        return pd.read_csv(
+            self.TEST_FILE,
+            parse_dates=["datetime"], index_col="datetime"
+        )
+
+    @pytest.fixture(scope="class")
+    def result(self, test_data):
+        return run_elevation_bands(
+            test_data, 2103.0, self.BANDS, band_areas=[1.0, 2.0, 1.0],
+            nthreads=2
+        )
+
+    def test_dew_point(self):
+        e_a = np.array([100.0, 611.2, 1500.0])
+        np.testing.assert_allclose(vapor_pressure_at(dew_point(e_a)), e_a)
+        assert dew_point(611.2) == pytest.approx(0.0)
+
+    def test_station_band(self, test_data, result):
+        df_bands, _ = result
+        expected = run_model(
+            test_data.index.min(), test_data.index.max(), 2103.0, test_data
+        )
+        # no lapsing at the station elevation
+        pd.testing.assert_frame_equal(
+            df_bands.xs(2103.0, level="elevation"), expected
+        )
+
+    def test_bands(self, result):
+        df_bands, df_basin = result
+        assert df_bands.index.names == ["elevation", "datetime"]
+        assert len(df_bands) == 3 * len(df_basin) == 3 * 302
+
+        # colder and more snow up high
+        peak = df_bands["specific_mass"].groupby("elevation").max()
+        assert peak.is_monotonic_increasing
+
+        swe = df_bands["specific_mass"].unstack("elevation")
+        np.testing.assert_allclose(
+            df_basin["specific_mass"],
+            (swe[1800.0] + 2 * swe[2103.0] + swe[2500.0]) / 4
+        )
+
+        # snow temperatures only over bands with snow
+        assert df_basin["temp_surf"].isna().any()
+        assert (df_basin["temp_surf"].dropna() > -75).all()
+
+    def test_basin_snow_properties(self, test_data):
+        # a steep lapse rate melts out the low band early
+        df_bands, df_basin = run_elevation_bands(
+            test_data, 2103.0, [500.0, 2103.0], band_areas=[3.0, 1.0],
+            lapse_rates={"air_temp": -0.02}
+        )
+        swe = df_bands["specific_mass"].unstack("elevation")
+        density = df_bands["snow_density"].unstack("elevation")
+        cold_content = df_bands["cold_content"].unstack("elevation")
+        only_high = (swe[500.0] <= 0) & (swe[2103.0] > 0)
+        assert only_high.any()
+
+        # snow properties come from the band with snow, mass and cold
+        # content are per area of the whole basin
+        pd.testing.assert_series_equal(
+            df_basin.loc[only_high, "snow_density"],
+            density.loc[only_high, 2103.0], check_names=False
+        )
+        np.testing.assert_allclose(
+            df_basin.loc[only_high, "specific_mass"],
+            swe.loc[only_high, 2103.0] / 4
+        )
+        assert (cold_content.loc[only_high, 2103.0] < 0).any()
+        np.testing.assert_allclose(
+            df_basin.loc[only_high, "cold_content"],
+            cold_content.loc[only_high, 2103.0] / 4
+        )
+
+    def test_bad_lapse_rate(self, test_data):
+        with pytest.raises(ValueError):
+            run_elevation_bands(
+                test_data, 2103.0, self.BANDS, lapse_rates={"wind": 0.1}
+            )
@@ -1,8 +1,42 @@
+import numpy as np
 import pandas as pd
 import pytest
 from pathlib import Path
 
-from pointsnobal.point_model import run_model
+from pointsnobal.c_snobal import snobal
+from pointsnobal.point_model import (
+    initialize_model, output_steps, prepare_forcing, run_grid, run_model
+)
+
+
+def step_model(model_datetimes, forcing, output_record, tstep_info,
+               constants):
+    """
+    Reference run that returns to python every timestep, the specific
+    mass at each output timestep
+    """
+    shape = output_record["elevation"].shape
+    output_record["current_time"] = np.zeros(shape)
+    output_record["time_since_out"] = np.zeros(shape)
+
+    steps = output_steps(len(model_datetimes), tstep_info)
+    input1 = {key: value[0].reshape(shape) for key, value in forcing.items()}
+    result = []
+    for j in range(1, len(model_datetimes)):
+        input2 = {
+            key: value[j].reshape(shape) for key, value in forcing.items()
+        }
+        rt = snobal.do_tstep_grid(
+            input1, input2, output_record, tstep_info, constants, constants,
+            first_step=j
+        )
+        assert rt == -1
+        input1 = input2
+
+        if steps[j]:
+            result.append(output_record["m_s"].copy())
+            output_record["time_since_out"] = np.zeros(shape)
+    return np.array(result)
 
 
 class TestRunSnobal:
@@ -26,6 +60,220 @@ class TestRunSnobal:
             start_date, end_date, 2103.0, test_data
         )
         assert len(result) == 302
+        # value from a neutral start of hle1 on every timestep, the warm
+        # start changes specific_mass by at most 7.6e-6 mm
         assert result["specific_mass"].values[200] == pytest.approx(
-            1623.4878530514477
+            1623.4878530514477, abs=1e-4
+        )
+
+
+class TestRunGrid:
+    TEST_FILE = Path(__file__).parent.joinpath(
+        "data/inputs_csl_2023.csv"
+    )
+    ELEVATIONS = np.array([[1800.0, 2103.0, 2500.0]])
+
+    @pytest.fixture(scope="class")
+    def forcing(self):
+        df = pd.read_csv(
+            self.TEST_FILE,
+            parse_dates=["datetime"], index_col="datetime"
+        )
+        forcing = prepare_forcing(df)
+        # same forcing for every pixel, [time, pixel]
+        forcing = {
+            key: np.repeat(value[:, None], self.ELEVATIONS.size, axis=1)
+            for key, value in forcing.items()
+        }
+        return df.index, forcing
+
+    @pytest.fixture(scope="class")
+    def expected(self, forcing):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        return step_model(
+            model_datetimes, forcing, output_record, tstep_info, constants
+        )
+
+    @pytest.mark.parametrize("schedule, chunk, nthreads, first_touch", [
+        ("static", 0, 1, True),
+        ("static", 1, 2, True),
+        ("dynamic", 2, 3, False),
+        ("guided", 0, 2, True),
+    ])
+    def test_run_grid(
+            self, forcing, expected, schedule, chunk, nthreads, first_touch
+    ):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        datetimes, result = run_grid(
+            model_datetimes, forcing, output_record, tstep_info, constants,
+            nthreads=nthreads, schedule=schedule, chunk=chunk,
+            first_touch=first_touch
+        )
+        assert len(datetimes) == len(expected) == 302
+        np.testing.assert_array_equal(result["m_s"], expected)
+        np.testing.assert_array_equal(output_record["m_s"], expected[-1])
+
+    def test_warm_start(self, forcing, expected):
+        model_datetimes, forcing = forcing
+        results = {}
+        counts = {}
+        for warm_start in [True, False]:
+            output_record, tstep_info, constants, _ = initialize_model(
+                model_datetimes, self.ELEVATIONS
+            )
+            constants["warm_start"] = warm_start
+            snobal.get_hle1_counters(reset=True)
+            _, results[warm_start] = run_grid(
+                model_datetimes, forcing, output_record, tstep_info,
+                constants
+            )
+            counts[warm_start] = snobal.get_hle1_counters(reset=True)
+
+        np.testing.assert_array_equal(results[True]["m_s"], expected)
+        # same answer within the hle1 convergence threshold
+        np.testing.assert_allclose(
+            results[False]["m_s"], expected, rtol=1e-6
+        )
+        assert counts[True]["calls"] == counts[False]["calls"]
+        assert counts[True]["iterations"] < counts[False]["iterations"]
+
+    def test_aggregators(self, forcing, expected):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        datetimes, result, aggregates = run_grid(
+            model_datetimes, forcing, output_record, tstep_info, constants,
+            nthreads=2, aggregators={
+                "R_n": ("R_n", "mean", "1D"),
+                "melt": ("melt", "sum", "1D"),
+                "peak_melt": ("melt", "max", "1D"),
+                "T_s_0_min": ("T_s_0", "min", "1D"),
+                "T_s_0_max": ("T_s_0", "max", "1D"),
+                "m_s": ("m_s", "mean", "5D"),
+            }
+        )
+        np.testing.assert_array_equal(result["m_s"], expected)
+
+        # daily periods line up with the daily outputs
+        for name in ["R_n", "melt", "peak_melt", "T_s_0_min"]:
+            assert aggregates[name][0].equals(datetimes)
+        np.testing.assert_allclose(
+            aggregates["R_n"][1], result["R_n_bar"], atol=1e-9
+        )
+        np.testing.assert_allclose(
+            aggregates["melt"][1], result["melt_sum"], atol=1e-9
+        )
+        assert (aggregates["peak_melt"][1] <= result["melt_sum"]).all()
+        snow = result["layer_count"] > 0
+        assert (aggregates["T_s_0_min"][1][snow] <= result["T_s_0"][snow]).all()
+        assert (aggregates["T_s_0_max"][1][snow] >= result["T_s_0"][snow]).all()
+
+        # the last five day period is cut short by the end of the run
+        five_day, m_s = aggregates["m_s"]
+        assert len(five_day) == 61
+        assert five_day[-1] == datetimes[-1]
+        assert np.isfinite(m_s).all()
+
+    @pytest.mark.filterwarnings("ignore:All-NaN slice:RuntimeWarning")
+    @pytest.mark.filterwarnings("ignore:Mean of empty slice:RuntimeWarning")
+    def test_aggregators_snow_only(self, forcing):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        _, _, aggregates = run_grid(
+            model_datetimes, forcing, output_record, tstep_info, constants,
+            aggregators={
+                "step": ("T_s_0", "mean", "6h"),
+                "mean": ("T_s_0", "mean", "1D"),
+                "min": ("T_s_0", "min", "1D"),
+                "lower": ("T_s_l", "mean", "6h"),
+            }
+        )
+        ends, step = aggregates["step"]
+        days, mean = aggregates["mean"]
+
+        # the day to 2022-11-02 only has snow in its last timestep, snow
+        # free timesteps do not bring in the -75 C fill value
+        day = days.get_loc(pd.Timestamp("2022-11-02"))
+        assert mean[day] == pytest.approx(273.16)
+        assert aggregates["min"][1][day] == pytest.approx(273.16)
+        # days without any snow are NaN
+        assert np.isnan(mean[:day]).all()
+
+        # daily statistics of the timesteps with snow
+        step = step.reshape(len(days), -1, *self.ELEVATIONS.shape)
+        np.testing.assert_allclose(mean, np.nanmean(step, axis=1))
+        np.testing.assert_array_equal(
+            aggregates["min"][1], np.nanmin(step, axis=1)
+        )
+
+        # the lower layer temperature needs a lower layer
+        lower = aggregates["lower"][1]
+        assert np.isfinite(lower).any()
+        assert (lower[np.isfinite(lower)] > 273.16 - 75).all()
+
+    def test_aggregators_bad_period(self, forcing):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        with pytest.raises(ValueError):
+            run_grid(
+                model_datetimes, forcing, output_record, tstep_info,
+                constants, aggregators={"melt": ("melt", "sum", "90min")}
+            )
+
+    @pytest.mark.parametrize("bad", ["inputs", "outputs", "nthreads"])
+    def test_series_sizes(self, forcing, bad):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        n_steps = len(model_datetimes)
+        inputs = {
+            key: value.reshape(n_steps, -1) for key, value in forcing.items()
+        }
+        out_steps = np.ones(n_steps, dtype=bool)
+        output_series = {
+            key: np.zeros((n_steps - 1,) + self.ELEVATIONS.shape)
+            for key in output_record
+        }
+        snobal.do_tstep_series(
+            inputs, output_record, tstep_info, constants, constants,
+            out_steps, output_series
+        )
+
+        nthreads = 1
+        if bad == "inputs":
+            inputs["T_a"] = inputs["T_a"][:2]
+        elif bad == "outputs":
+            output_series["m_s"] = output_series["m_s"][:2]
+        else:
+            nthreads = 0
+        with pytest.raises(ValueError):
+            snobal.do_tstep_series(
+                inputs, output_record, tstep_info, constants, constants,
+                out_steps, output_series, nthreads=nthreads
+            )
+
+    def test_state_without_obukhov_lo(self, forcing, expected):
+        model_datetimes, forcing = forcing
+        output_record, tstep_info, constants, _ = initialize_model(
+            model_datetimes, self.ELEVATIONS
+        )
+        # states saved before the Obukhov length was kept, hle1 starts
+        # from neutral stability at every data timestep
+        del output_record["obukhov_lo"]
+        result = step_model(
+            model_datetimes, forcing, output_record, tstep_info, constants
         )
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+        assert "obukhov_lo" not in output_record
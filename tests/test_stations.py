@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+
+from pointsnobal.point_model import run_model
+from pointsnobal.stations import run_stations
+
+
+class TestRunStations:
+    TEST_FILE = Path(__file__).parent.joinpath(
+        "data/inputs_csl_2023.csv"
+    )
+
+    @pytest.fixture(scope="class")
+    def inputs(self):
+        df = pd.read_csv(
+            self.TEST_FILE,
+            parse_dates=["datetime"], index_col="datetime"
+        )
+        # stations do not need the same period
+        return {"csl": df, "low": df, "short": df.iloc[:500]}
+
+    @pytest.fixture(scope="class")
+    def elevations(self):
+        return {"csl": 2103.0, "low": 1800.0, "short": 2103.0}
+
+    @pytest.mark.parametrize("n_jobs", [1, 2])
+    def test_run_stations(self, inputs, elevations, n_jobs):
+        with run_stations(inputs, elevations, n_jobs=n_jobs) as results:
+            assert results.stations == ["csl", "low", "short"]
+            for station, df in inputs.items():
+                expected = run_model(
+                    df.index.min(), df.index.max(), elevations[station], df
+                )
+                pd.testing.assert_frame_equal(
+                    results.station(station), expected
+                )
+
+            df_all = results.to_dataframe(copy=False)
+            assert len(df_all) == results.offsets[-1] == 302 * 2 + 125
+            assert np.shares_memory(df_all.values, results.values)
+            del df_all
+
+    def test_use_after_close(self, inputs, elevations):
+        with run_stations(inputs, elevations) as results:
+            df = results.station("csl")
+            df_all = results.to_dataframe()
+        assert df["specific_mass"].max() > 0
+        assert np.isfinite(df_all.values).all()
+
+    def test_close_with_views(self, inputs, elevations):
+        results = run_stations(inputs, elevations)
+        view = results.station("csl", copy=False)
+        with pytest.raises(BufferError):
+            results.close()
+        # still readable after the failed close
+        assert view["specific_mass"].max() > 0
+        assert np.isfinite(results.values).all()
+
+        del view
+        results.close()
+        assert results.values is None
+
+    def test_to_parquet(self, inputs, elevations, tmp_path):
+        pytest.importorskip("pyarrow")
+        path = tmp_path.joinpath("stations.parquet")
+        with run_stations(inputs, elevations) as results:
+            results.to_parquet(path)
+            expected = results.to_dataframe().reset_index()
+        pd.testing.assert_frame_equal(pd.read_parquet(path), expected)
+
+    def test_missing_elevation(self, inputs):
+        with pytest.raises(ValueError):
+            run_stations(inputs, {"csl": 2103.0})